@@ -12,18 +12,42 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import cgitb
 import os
 import sys
 
-# Get verbose tracebacks, so we can diagnose better.
-cgitb.enable(format="plain")
-
-
 # Set debug_flag=True in order to debug this program or to get hints
 # about what's going wrong in your system.
 debug_flag = os.environ.get("CHUTNEY_DEBUG", "") != ""
 
+
+def _verbose_excepthook(etype, evalue, etb):
+    """Print a traceback for an uncaught exception.  If debug_flag is
+       True, print a verbose cgitb traceback, including local variables.
+
+       cgitb is slow to import, and slow to format a traceback, so we only
+       use it when debugging.  If it is not available, fall back to the
+       standard traceback.
+    """
+    if not debug_flag:
+        sys.__excepthook__(etype, evalue, etb)
+        return
+    try:
+        import cgitb
+    except ImportError:
+        sys.__excepthook__(etype, evalue, etb)
+        return
+    cgitb.Hook(format="plain")(etype, evalue, etb)
+
+
+def install_verbose_tracebacks():
+    """Get verbose tracebacks for uncaught exceptions when debugging."""
+    sys.excepthook = _verbose_excepthook
+
+
+# Get verbose tracebacks, so we can diagnose better.
+install_verbose_tracebacks()
+
+
 def debug(s):
     "Print a debug message on stdout if debug_flag is True."
     if debug_flag:
@@ -6,19 +6,25 @@ from __future__ import unicode_literals
 import socket
 import chutney.Util
 
-@chutney.Util.memoized
-def is_ipv6_supported():
-    """Return true iff ipv6 is supported on this host."""
+def _probe_ipv6():
+    """Return true iff we can bind and listen on the ipv6 loopback address."""
+    s = None
     try:
         s = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
         s.bind(("::1", 0))
-        s.listen(128)
-        a = s.getsockname()
-        s2 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        s2.settimeout(1)
-        s2.connect(a)
+        s.listen(1)
         return True
     except socket.error:
         return False
+    finally:
+        if s is not None:
+            s.close()
 
+@chutney.Util.memoized
+def is_ipv6_supported():
+    """Return true iff ipv6 is supported on this host.
 
+       The result is cached for the rest of this process.  We don't share it
+       with other processes: probing is cheap, and the result can change with
+       the network namespace or the host's ipv6 settings."""
+    return _probe_ipv6()
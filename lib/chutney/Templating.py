@@ -83,8 +83,9 @@ from __future__ import unicode_literals
 
 from pathlib import Path
 
-import string
 import os
+import re
+import string
 
 # class _KeyError(KeyError):
 #    pass
@@ -124,21 +125,22 @@ class _DictWrapper(object):
             return self._getitem(key, my)
         except KeyError:
             pass
-        if self._parent is None:
-            raise _KeyError(key)
+        return self._parentLookup(key, my)
 
-        try:
-            lookup = self._parent.lookup
-        except AttributeError:
-            try:
-                return self._parent[key]
-            except KeyError:
-                raise _KeyError(key)
+    def _parentLookup(self, key, my):
+        """Look up key in our parent, relative to 'my'.  Raise KeyError if
+           there is no parent, or the parent doesn't have key.
+        """
+        parent = self._parent
+        if parent is None:
+            raise _KeyError(key)
 
-        try:
+        lookup = getattr(parent, "lookup", None)
+        if lookup is not None:
             return lookup(key, my)
-        except KeyError:
-            raise _KeyError(key)
+        if key in parent:
+            return parent[key]
+        raise _KeyError(key)
 
 
 class Environ(_DictWrapper):
@@ -203,25 +205,47 @@ class Environ(_DictWrapper):
     # Fields
     # _dict: dictionary holding the contents of this Environ that are
     #   not inherited from the parent and are not computed on the fly.
+    # _GETTERS: a map from each key that is computed on the fly to the
+    #   name of its _get_KEY() function.  Computed once per class, and
+    #   copied to the instance by set_runtime().
+
+    _GETTERS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._GETTERS = { name[5:]: name for name in dir(cls)
+                         if name.startswith("_get_") }
 
     def __init__(self, parent=None, **kw):
         _DictWrapper.__init__(self, parent)
         self._dict = kw
 
-    def _getitem(self, key, my):
-        try:
-            return self._dict[key]
-        except KeyError:
-            pass
+    def set_runtime(self, key, fn):
+        """Compute the value of key on the fly for this Environ only, by
+           calling fn(my).
+        """
+        name = "_get_" + key
+        setattr(self, name, fn)
+        getters = dict(self._GETTERS)
+        getters[key] = name
+        self._GETTERS = getters
 
-        fn = getattr(self, "_get_%s" % key, None)
-        if fn is not None:
+    def lookup(self, key, my):
+        """As _DictWrapper.lookup, but check our own values and getters
+           directly, so that keys we don't have go straight to the parent.
+           (Environ implements lookup() instead of _getitem().)
+        """
+        d = self._dict
+        if key in d:
+            return d[key]
+
+        name = self._GETTERS.get(key)
+        if name is not None:
             try:
-                rv = fn(my)
-                return rv
-            except _KeyError:
-                raise KeyError(key)
-        raise KeyError(key)
+                return getattr(self, name)(my)
+            except KeyError:
+                pass
+        return self._parentLookup(key, my)
 
     def __setitem__(self, key, val):
         self._dict[key] = val
@@ -231,7 +255,7 @@ class Environ(_DictWrapper):
         s.update(self._dict.keys())
         if self._parent is not None:
             s.update(self._parent.keys())
-        s.update(name[5:] for name in dir(self) if name.startswith("_get_"))
+        s.update(self._GETTERS)
         return s
 
 class IncluderDict(_DictWrapper):
@@ -246,6 +270,12 @@ class IncluderDict(_DictWrapper):
     #   for files given as relative paths.
     # _st_mtime: the most recent time when any of the files included
     #   so far has been updated.  (As seconds since the epoch).
+    # _dir_cache: a list of (directory, set of names in directory) for
+    #   each element of _includePath, or None if we haven't listed them yet.
+
+    # Contents of the files we have included, keyed by
+    # (absolute path, mtime, size).  Shared by all IncluderDicts.
+    _FILE_CACHE = {}
 
     def __init__(self, parent, includePath=(".",)):
         """Create a new IncluderDict.  Non-include entries are delegated to
@@ -255,6 +285,7 @@ class IncluderDict(_DictWrapper):
         _DictWrapper.__init__(self, parent)
         self._includePath = includePath
         self._st_mtime = 0
+        self._dir_cache = None
 
     def _getitem(self, key, my):
         if not key.startswith("include:"):
@@ -262,23 +293,58 @@ class IncluderDict(_DictWrapper):
 
         filename = Path(key[len("include:"):])
         if filename.is_absolute():
-            with filename.open(mode='r') as f:
-                stat = os.fstat(f.fileno())
-                if stat.st_mtime > self._st_mtime:
-                    self._st_mtime = stat.st_mtime
-                return f.read()
-
-        for elt in self._includePath:
-            fullname = Path(elt, filename)
-            if fullname.exists():
-                with fullname.open(mode='r') as f:
-                    stat = os.fstat(f.fileno())
-                    if stat.st_mtime > self._st_mtime:
-                        self._st_mtime = stat.st_mtime
-                    return f.read()
+            return self._readFile(filename)
+
+        if len(filename.parts) != 1:
+            for elt in self._includePath:
+                fullname = Path(elt, filename)
+                if fullname.exists():
+                    return self._readFile(fullname)
+            raise KeyError(key)
+
+        name = filename.name
+        for elt, names in self._listIncludeDirs():
+            if name in names:
+                # a listed name can be a dangling symlink, or have been
+                # removed since we listed the directory
+                try:
+                    return self._readFile(Path(elt, name))
+                except FileNotFoundError:
+                    pass
 
         raise KeyError(key)
 
+    def _listIncludeDirs(self):
+        """Return a list of (directory, set of names) for each directory in
+           our include path.  Each directory is only listed once per
+           IncluderDict, so repeated includes don't stat every candidate.
+        """
+        if self._dir_cache is None:
+            self._dir_cache = []
+            for elt in self._includePath:
+                try:
+                    names = frozenset(os.listdir(elt))
+                except OSError:
+                    names = frozenset()
+                self._dir_cache.append((elt, names))
+        return self._dir_cache
+
+    def _readFile(self, fullname):
+        """Return the contents of the file fullname, and update _st_mtime.
+           Unchanged files are served from _FILE_CACHE.
+        """
+        fullname = os.path.abspath(fullname)
+        stat = os.stat(fullname)
+        if stat.st_mtime > self._st_mtime:
+            self._st_mtime = stat.st_mtime
+        cache_key = (fullname, stat.st_mtime, stat.st_size)
+        contents = IncluderDict._FILE_CACHE.get(cache_key)
+        if contents is None:
+            with open(fullname, 'r') as f:
+                contents = f.read()
+            IncluderDict._FILE_CACHE[cache_key] = contents
+        return contents
+
     def getUpdateTime(self):
         return self._st_mtime
 
@@ -321,6 +387,12 @@ class _BetterTemplate(string.Template):
     def __init__(self, template):
         string.Template.__init__(self, template)
 
+# The same syntax as _BetterTemplate.pattern, using numbered groups:
+#   1: $$, 2: $var, 3: ${var}, 4: any other $ (which is invalid).
+_PAT = re.compile(r'\$(?:(\$)|(%s)|\{(%s)\}|())' %
+                  (_BetterTemplate.idpattern, _BetterTemplate.idpattern),
+                  re.IGNORECASE | re.ASCII)
+
 
 class _FindVarsHelper(object):
 
@@ -357,6 +429,26 @@ class Template(object):
           ${include:filename} -- expands to the contents of filename
 
        Substitutions are performed iteratively until no more are possible.
+       Each pass substitutes the whole string, so $$ and values containing
+       variables are expanded again by the next pass:
+
+       >>> Template("$$a$a").format({'a': '${c}', 'c': '1'})
+       '11'
+       >>> Template("$${x}").format({'x': '$y', 'y': 'z'})
+       'z'
+
+       A value that expands to itself is left as it is:
+
+       >>> Template("${a}").format({'a': '${a}'})
+       '${a}'
+
+       But cycles that keep changing the string stop after MAX_ITERATIONS
+       passes:
+
+       >>> Template("$a").format({'a': '$b', 'b': '$a'})
+       Traceback (most recent call last):
+           ...
+       ValueError: Too many iterations in expanding template!
     """
 
     # Okay, actually, we stop after this many substitutions to avoid
@@ -386,10 +478,13 @@ class Template(object):
         """
         values = IncluderDict(values, self._includePath)
         values = PathDict(values)
+        # the string value of each variable we've looked up, which doesn't
+        # change between passes
+        strings = {}
         orig_val = self._pat
         nIterations = 0
         while True:
-            v = _BetterTemplate(orig_val).substitute(values)
+            v = self._substitute(orig_val, values, strings)
             if v == orig_val:
                 return v
             orig_val = v
@@ -397,6 +492,33 @@ class Template(object):
             if nIterations > self.MAX_ITERATIONS:
                 raise ValueError("Too many iterations in expanding template!")
 
+    @staticmethod
+    def _substitute(pat, values, strings):
+        """Return pat after one substitution pass, like
+           string.Template.substitute(): each variable is replaced by its
+           value from 'values' (which are cached in 'strings'), and $$
+           becomes a single $.
+        """
+        # pat is the whole partly expanded template, so this mostly cuts
+        # short the last pass of format(), when nothing is left to expand
+        if "$" not in pat:
+            return pat
+
+        def convert(mo):
+            group = mo.lastindex
+            if group == 2 or group == 3:
+                name = mo.group(group)
+                value = strings.get(name)
+                if value is None:
+                    value = strings[name] = str(values[name])
+                return value
+            if group == 1:
+                return "$"
+            raise ValueError("Invalid placeholder in template: %r" %
+                             pat[mo.start():mo.start() + 2])
+
+        return _PAT.sub(convert, pat)
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) == 1:
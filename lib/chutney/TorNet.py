@@ -14,17 +14,26 @@ from __future__ import unicode_literals
 
 from pathlib import Path
 
-import cgitb
+import atexit
+import concurrent.futures
 import errno
+import functools
 import importlib
+import json
 import os
-import platform
 import re
+import shutil
 import signal
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import base64
+import contextlib
+import mmap
+import select
 
 from chutney.Debug import debug_flag, debug
 
@@ -44,12 +53,149 @@ _THE_NETWORK = None
 TORRC_OPTION_WARN_LIMIT = 10
 torrc_option_warn_count =  0
 
-# Get verbose tracebacks, so we can diagnose better.
-cgitb.enable(format="plain")
+# Messages for torrc options that our tor binary doesn't support
+_UNSUPPORTED_OPTION_WARNING = ("The tor binary at {} does not support "
+                               "the option in the torrc line:\n{}")
+_UNSUPPORTED_OPTION_COMMENT = "# {} version {} does not support: "
+
+# The characters in a relay's hex fingerprint
+_HEX = frozenset('0123456789ABCDEF')
+
+# Patterns for checking and parsing the output of tor's probe options
+_RE_TOR_VERSION = re.compile(r'^[-+.() A-Za-z0-9]+$')
+_RE_TORRC_OPTS = re.compile(r'(^\w+$)+', re.MULTILINE)
+_RE_MOD_LINE = re.compile(r'^(\S+): (yes|no)')
+
+# Log messages for bootstrap progress and onion service descriptor uploads.
+# These match bytes, so that we can search log files without decoding them.
+_RE_BOOTSTRAP = re.compile(rb'Bootstrapped (\d+)%(?: \(([^\)]*)\))?: (.*)')
+_RE_ONIONDESC = re.compile(
+    rb'Launching upload for hidden service (.*)'
+    rb'|Service ([^\s]+ [^\s]+ descriptor of revision .*)')
+
+@contextlib.contextmanager
+def _mapped_file(path):
+    """Context manager: map the file at path into memory, and yield its
+       contents as a bytes-like object.  (Empty files can't be mapped, so
+       we yield b"" for them.)
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+def _count_lines(data, limit):
+    """Return the number of lines in the bytes-like object data, counting
+       an unterminated last line, or limit if there are more lines than
+       that.
+    """
+    count = 0
+    pos = 0
+    size = len(data)
+    while pos < size and count < limit:
+        count += 1
+        pos = data.find(b"\n", pos)
+        if pos < 0:
+            break
+        pos += 1
+    return count
+
+def _readAppendedLines(path, offset):
+    """Read the complete lines that have been appended to the file at path
+       since byte offset.  Returns a 3-tuple: the lines as bytes, the
+       offset to pass to the next call, and True if the file was shorter
+       than offset (and has therefore been re-read from the start).
+
+       An unterminated last line is left for the next call, so that we
+       never match a partially written log message.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        restarted = size < offset
+        if restarted:
+            offset = 0
+        f.seek(offset)
+        data = f.read(size - offset)
+    end = data.rfind(b"\n") + 1
+    return (data[:end], offset + end, restarted)
+
+# How much of a log to read at a time, when searching backwards
+_LOG_SEARCH_CHUNK_SIZE = 64 * 1024
+
+def _searchLogBackwards(path, pattern, chunk_size=_LOG_SEARCH_CHUNK_SIZE):
+    """Search the complete lines of the file at path for the last match of
+       the bytes pattern, reading chunk_size bytes at a time, starting from
+       the end of the file.  Returns a 2-tuple: the groups of the last
+       match (or None if there is no match), and the offset just after
+       the last complete line, for use with _readAppendedLines().
+
+       The latest status message is usually near the end of a log, so
+       this only reads the whole file if the pattern is rare.
+    """
+    with open(path, 'rb') as f:
+        pos = os.fstat(f.fileno()).st_size
+        end = None
+        # the end of a line that we split at the start of the last chunk
+        partial = b""
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            buf = f.read(pos - start) + partial
+            pos = start
+            if end is None:
+                # leave an unterminated last line for the next scan
+                newline = buf.rfind(b"\n")
+                if newline < 0:
+                    partial = buf
+                    continue
+                end = start + newline + 1
+                buf = buf[:newline + 1]
+            if start > 0:
+                # don't search a line that we split, keep it for the next
+                # chunk instead
+                newline = buf.find(b"\n")
+                if newline < 0:
+                    partial = buf
+                    continue
+                partial = buf[:newline + 1]
+                buf = buf[newline + 1:]
+            m = None
+            for m in pattern.finditer(buf):
+                pass
+            if m:
+                return (m.groups(), end)
+    return (None, end or 0)
+
+def _hasLinePrefix(data, prefix):
+    """Return True iff a line in the bytes-like object data starts with
+       the bytes prefix.
+    """
+    if data[:len(prefix)] == prefix:
+        return True
+    return data.find(b"\n" + prefix) >= 0
+
+def _decodeLog(b):
+    """Decode bytes b from a tor log file, passing through None."""
+    if b is None:
+        return None
+    return b.decode('utf-8', 'replace')
+
+# A torrc line that turns on RunAsDaemon
+_RE_RUN_AS_DAEMON = re.compile(r'^\s*RunAsDaemon\s+1(?:\s|$)', re.IGNORECASE)
+
+# A torrc line that sets an option, with the option name in group 1.
+# Matches the whole line, including its newline.
+_RE_OPTION_LINE = re.compile(r'^[^\S\n]*([^\s#]\S*)[^\n]*\n?', re.MULTILINE)
 
 class MissingBinaryException(Exception):
     pass
 
+def _isFingerprint(s):
+    """Return True iff s is a 40-character upper-case hex fingerprint."""
+    return len(s) == 40 and _HEX.issuperset(s)
+
 def getenv_type(env_var, default, type_, type_name=None):
     """
        Return the value of the environment variable 'envar' as type_,
@@ -89,16 +235,16 @@ def getenv_bool(env_var, default):
 
        Raise ValueError if the environment variable is set, but is not a bool.
     """
+    strval = os.environ.get(env_var)
+    if strval is None:
+        return default
     try:
         # Handle integer values
-        return bool(getenv_int(env_var, default))
+        return bool(int(strval))
     except ValueError:
-        # Handle values that the user probably expects to be False
-        strval = os.environ.get(env_var)
-        if strval.lower() in ['false', 'no']:
-            return False
-        else:
-            return getenv_type(env_var, default, bool, type_name='a bool')
+        # Handle values that the user probably expects to be False,
+        # and treat any other non-empty string as True, like bool()
+        return strval.lower() not in ('false', 'no', '')
 
 def mkdir_p(*d, mode=448):
     """Create directory 'd' and all of its parents as needed.  Unlike
@@ -112,7 +258,7 @@ def mkdir_p(*d, mode=448):
        permissions for the intermediate directories.  In python3, 'mode'
        only sets the mode for the last directory created.
     """
-    Path(*d).mkdir(mode=mode, parents=True, exist_ok=True)
+    os.makedirs(os.path.join(*d), mode=mode, exist_ok=True)
 
 def make_datadir_subdirectory(datadir, subdir):
     """
@@ -122,10 +268,13 @@ def make_datadir_subdirectory(datadir, subdir):
     mkdir_p(datadir)
     mkdir_p(datadir, subdir)
 
+@chutney.Util.memoized
 def get_absolute_chutney_path():
     """
        Returns the absolute path of the directory containing the chutney
        executable script.
+
+       The path is only resolved once per process.
     """
     # use the current directory as the default
     # (./chutney already sets CHUTNEY_PATH using the path to the script)
@@ -134,6 +283,7 @@ def get_absolute_chutney_path():
     relative_chutney_path = Path(os.environ.get('CHUTNEY_PATH', os.getcwd()))
     return relative_chutney_path.resolve()
 
+@chutney.Util.memoized
 def get_absolute_net_path():
     """
        Returns the absolute path of the "net" directory that chutney should
@@ -149,6 +299,9 @@ def get_absolute_net_path():
 
        Finally, return the path relative to the current working directory,
        regardless of whether the path actually exists.
+
+       The path is only resolved once per process, so creating the
+       directory later doesn't change the answer.
     """
     data_dir = Path(os.environ.get('CHUTNEY_DATA_DIR', 'net'))
     if data_dir.is_absolute():
@@ -168,6 +321,7 @@ def get_absolute_net_path():
     # or not the path actually exists
     return relative_net_path.resolve()
 
+@chutney.Util.memoized
 def get_absolute_nodes_path():
     """
        Returns the absolute path of the "nodes" symlink that points to the
@@ -181,33 +335,59 @@ def get_absolute_nodes_path():
     """
     return Path(get_absolute_net_path(), 'nodes')
 
-def get_new_absolute_nodes_path(now=time.time()):
-    """
-       Returns the absolute path of a unique "nodes*" directory that chutney
-       should use to store the current network's torrcs and tor runtime data.
-
-       The nodes directory suffix is based on the current timestamp,
-       incremented if necessary to avoid collisions with existing directories.
+# Resolved "nodes" directories, keyed by net_base_dir.
+# Cleared whenever we re-point the nodes link.
+_RESOLVED_NODES_DIRS = {}
 
-       (The existing directory check contains known race conditions: running
-       multiple simultaneous chutney instances on the same "net" directory is
-       not supported. The uniqueness check is only designed to avoid
-       collisions if the clock is set backwards.)
+def get_resolved_nodes_dir(net_base_dir):
+    """
+       Returns the fully resolved path of the "nodes" directory under
+       net_base_dir.  The result is cached, so that we only follow the
+       "nodes" symlink once, rather than once per node.
+    """
+    # keyed by net_base_dir, so cache hits don't build any paths
+    resolved = _RESOLVED_NODES_DIRS.get(net_base_dir)
+    if resolved is None:
+        resolved = Path(net_base_dir, 'nodes').resolve()
+        _RESOLVED_NODES_DIRS[net_base_dir] = resolved
+    return resolved
+
+def get_new_absolute_nodes_path(now=None):
+    """
+       Creates a unique "nodes*" directory that chutney should use to store
+       the current network's torrcs and tor runtime data, and returns its
+       absolute path.
+
+       The nodes directory suffix is based on the current timestamp (or
+       'now', if given), incremented if necessary to avoid collisions with
+       existing directories.
+
+       The directory is created with mode 0700 as part of the uniqueness
+       check, so there is no race between choosing a name and creating it.
+       (Running multiple simultaneous chutney instances on the same "net"
+       directory is still not supported. The uniqueness check is only
+       designed to avoid collisions if the clock is set backwards.)
     """
     # automatically chosen to prevent path collisions, and result in an ordered
     # series of directory path names
     # should only be called by 'chutney configure', all other chutney commands
     # should use get_absolute_nodes_path()
+    if now is None:
+        now = time.time()
     nodesdir = get_absolute_nodes_path()
+    mkdir_p(nodesdir.parent)
     newdir = newdirbase = Path("%s.%d" % (nodesdir, now))
     # if the time is the same, fall back to a simple integer count
     # (this is very unlikely to happen unless the clock changes: it's not
     # possible to run multiple chutney networks at the same time)
     i = 0
-    while newdir.exists():
-        i += 1
-        newdir = "%s.%d" % (newdirbase, i)
-    return newdir
+    while True:
+        try:
+            newdir.mkdir(mode=448)
+            return newdir
+        except FileExistsError:
+            i += 1
+            newdir = Path("%s.%d" % (newdirbase, i))
 
 def _warnMissingTor(tor_path, cmdline, tor_name="tor"):
     """Log a warning that the binary canonically named tor_name can't be found
@@ -235,13 +415,19 @@ def run_tor(cmdline, exit_on_missing=True):
 
        If exit_on_missing is true, warn and exit if the tor binary is missing.
        Otherwise, raise a MissingBinaryException.
+
+       cmdline may be any sequence of strings; it is not modified.
     """
     if not debug_flag:
-        cmdline.append("--quiet")
+        cmdline = (*cmdline, "--quiet")
     try:
-        stdouterr = subprocess.check_output(cmdline,
-                                            stderr=subprocess.STDOUT,
-                                            universal_newlines=True)
+        # tor's output is ASCII, which is cheaper to decode than UTF-8
+        stdouterr = subprocess.run(cmdline,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   check=True,
+                                   encoding='ascii',
+                                   errors='replace').stdout
         debug(stdouterr)
     except OSError as e:
         # only catch file not found error
@@ -271,13 +457,15 @@ def launch_process(cmdline, tor_name="tor", stdin=None, exit_on_missing=True):
        logs. Pass stdin to the Popen constructor.
 
        Returns the Popen object for the launched process.
+
+       cmdline may be any sequence of strings; it is not modified.
     """
     if tor_name == "tor":
         if not debug_flag:
-            cmdline.append("--quiet")
+            cmdline = (*cmdline, "--quiet")
     elif tor_name == "tor-gencert":
         if debug_flag:
-            cmdline.append("-v")
+            cmdline = (*cmdline, "-v")
     else:
         raise ValueError("Unknown tor_name: '{}'".format(tor_name))
     try:
@@ -299,27 +487,212 @@ def launch_process(cmdline, tor_name="tor", stdin=None, exit_on_missing=True):
             raise
     return p
 
-def run_tor_gencert(cmdline, passphrase):
-    """Run the tor-gencert command line cmdline, which must start with the
-       path or name of a tor-gencert binary.
-       Then send passphrase to the stdin of the process.
+# How long a scan of the running processes stays fresh, in seconds
+LIVE_PIDS_MAX_AGE = 0.25
+# A (scan time, pid set) tuple, or None if we haven't scanned recently
+_LIVE_PIDS = None
+
+def get_live_pids():
+    """Return a set of the pids of all running processes, or None if we
+       can't list them on this platform.
+
+       On Linux, we list /proc once, and reuse the result for
+       LIVE_PIDS_MAX_AGE seconds, so that checking a whole network takes
+       one directory scan, rather than one kill() per node.
+    """
+    global _LIVE_PIDS
+    now = time.monotonic()
+    if _LIVE_PIDS is not None and now - _LIVE_PIDS[0] < LIVE_PIDS_MAX_AGE:
+        return _LIVE_PIDS[1]
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        pids = {int(p) for p in os.listdir('/proc') if p.isdigit()}
+    except OSError:
+        return None
+    _LIVE_PIDS = (now, pids)
+    return pids
+
+def invalidate_live_pids():
+    """Forget the last scan of the running processes.  Call this after
+       starting or signalling a process."""
+    global _LIVE_PIDS
+    _LIVE_PIDS = None
+
+def open_pidfd(pid):
+    """Return a pidfd for the process pid, or None if pidfds aren't
+       supported on this platform, or we can't open one for pid.
+
+       The pidfd becomes readable when the process exits, so we can wait
+       for it, rather than polling the process.
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        # ENOSYS on kernels before 5.3, or ESRCH if pid has exited
+        return None
+
+# How long to sleep when our processes have exited, but have not been reaped
+EXITED_PID_RECHECK_TIME = 0.1
+
+def wait_for_pidfds(poller, pidfds, deadline):
+    """Wait until all the processes in pidfds have exited, or until
+       time.monotonic() reaches deadline.  pidfds is a set of pidfds
+       registered with poller, a select.poll() object.  Exited pidfds are
+       removed from pidfds, and unregistered from poller.
+
+       If pidfds is None, we can't wait for the processes, so just sleep
+       until the deadline.  If pidfds is empty, the processes have already
+       exited, but they may not have been reaped yet, so sleep for up to
+       EXITED_PID_RECHECK_TIME.
+    """
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        return
+    if pidfds is None:
+        time.sleep(timeout)
+        return
+    if not pidfds:
+        time.sleep(min(timeout, EXITED_PID_RECHECK_TIME))
+    while pidfds:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            return
+        for (fd, _) in poller.poll(timeout * 1000):
+            poller.unregister(fd)
+            pidfds.discard(fd)
+    # some of these processes may be cached as running
+    invalidate_live_pids()
+
+def wait_tor_gencert(p, passphrase):
+    """Send passphrase to the stdin of p, a tor-gencert process started by
+       launch_process(), and wait for it to exit.
 
        Returns the combined stdout and stderr of the process.
     """
-    p = launch_process(cmdline,
-                        tor_name="tor-gencert",
-                        stdin=subprocess.PIPE)
     (stdouterr, empty_stderr) = p.communicate(passphrase + "\n")
     debug(stdouterr)
     assert p.returncode == 0  # XXXX BAD!
     assert empty_stderr is None
     return stdouterr
 
+# The name of the file in the net directory where we keep the results of
+# probing tor binaries between runs
+_TOR_PROBE_CACHE_NAME = '.tor_probe_cache.json'
+# The probe cache, loaded on first use: a map from each tor binary's
+# absolute path to {'id': [mtime_ns, size], probe name: result, ...}
+_tor_probe_cache = None
+# True if the probe cache has results that haven't been written to disk
+_tor_probe_cache_dirty = False
+_tor_probe_cache_lock = threading.Lock()
+
+def _getTorProbeCachePath():
+    return Path(get_absolute_net_path(), _TOR_PROBE_CACHE_NAME)
+
+def _loadTorProbeCache():
+    """Return the probe cache, reading it from disk if necessary."""
+    global _tor_probe_cache
+    if _tor_probe_cache is None:
+        try:
+            with _getTorProbeCachePath().open() as f:
+                _tor_probe_cache = json.load(f)
+        except (OSError, ValueError):
+            _tor_probe_cache = {}
+        if not isinstance(_tor_probe_cache, dict):
+            _tor_probe_cache = {}
+    return _tor_probe_cache
+
+def _saveTorProbeCache():
+    """Write the probe cache to disk, ignoring any errors: the cache is
+       only an optimisation.
+
+       The cache is written to a unique temporary file, then moved into
+       place, so that concurrent chutney processes never see (or write
+       over) a partially written cache.
+    """
+    path = _getTorProbeCachePath()
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile('w',
+                                         dir=path.parent,
+                                         prefix=path.name + '.',
+                                         suffix='.tmp',
+                                         delete=False) as f:
+            tmp_path = f.name
+            json.dump(_tor_probe_cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        debug("Could not write tor probe cache {}: {}".format(path, e))
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+@atexit.register
+def flush_tor_probe_cache():
+    """Write any new probe results to disk.  Called after prefetching
+       probes, and when chutney exits.
+    """
+    global _tor_probe_cache_dirty
+    with _tor_probe_cache_lock:
+        if _tor_probe_cache_dirty:
+            _saveTorProbeCache()
+            _tor_probe_cache_dirty = False
+
+def disk_memoized(fn):
+    """Decorator: cache the results of fn(tor) in the net directory, so
+       that later chutney runs don't need to run the tor binary again.
+
+       Results are keyed on the absolute path of the tor binary, and
+       discarded when its mtime or size changes.
+    """
+    name = fn.__name__
+    @functools.wraps(fn)
+    def disk_memoized_fn(tor):
+        global _tor_probe_cache_dirty
+        binary = shutil.which(tor)
+        if binary is None:
+            return fn(tor)
+        binary = os.path.abspath(binary)
+        st = os.stat(binary)
+        binary_id = [st.st_mtime_ns, st.st_size]
+        with _tor_probe_cache_lock:
+            entry = _loadTorProbeCache().get(binary)
+            if (isinstance(entry, dict) and entry.get('id') == binary_id
+                    and name in entry):
+                return entry[name]
+        result = fn(tor)
+        with _tor_probe_cache_lock:
+            cache = _loadTorProbeCache()
+            entry = cache.get(binary)
+            if not isinstance(entry, dict) or entry.get('id') != binary_id:
+                entry = cache[binary] = {'id': binary_id}
+            entry[name] = result
+            # written by flush_tor_probe_cache(), so that each run writes
+            # the cache at most a few times, rather than once per probe
+            _tor_probe_cache_dirty = True
+        return result
+    return disk_memoized_fn
+
+@chutney.Util.memoized
+def _get_tor_version_output(tor):
+    """Return the output of 'tor --version' for the tor binary.
+       Raise MissingBinaryException if the binary is missing.
+
+       tor_exists() and get_tor_version() share this, so that we only
+       run 'tor --version' once for each unique tor path.
+    """
+    return run_tor((tor, "--version"), exit_on_missing=False)
+
 @chutney.Util.memoized
 def tor_exists(tor):
     """Return true iff this tor binary exists."""
     try:
-        run_tor([tor, "--quiet", "--version"], exit_on_missing=False)
+        _get_tor_version_output(tor)
         return True
     except MissingBinaryException:
         return False
@@ -328,22 +701,23 @@ def tor_exists(tor):
 def tor_gencert_exists(gencert):
     """Return true iff this tor-gencert binary exists."""
     try:
-        p = launch_process([gencert, "--help"], exit_on_missing=False)
+        p = launch_process((gencert, "--help"), exit_on_missing=False)
         p.wait()
         return True
     except MissingBinaryException:
         return False
 
 @chutney.Util.memoized
+@disk_memoized
 def get_tor_version(tor):
     """Return the version of the tor binary.
        Versions are cached for each unique tor path.
     """
-    cmdline = [
-        tor,
-        "--version",
-    ]
-    tor_version = run_tor(cmdline)
+    try:
+        tor_version = _get_tor_version_output(tor)
+    except MissingBinaryException:
+        _warnMissingTor(tor, [tor, "--version"])
+        sys.exit(1)
     # Keep only the first line of the output: since #32102 a bunch of more
     # lines have been added to --version and we only care about the first
     tor_version = tor_version.split("\n")[0]
@@ -352,27 +726,32 @@ def get_tor_version(tor):
     tor_version = tor_version.replace("version ", "")
     tor_version = tor_version.replace(").", ")")
     # check we received a tor version, and nothing else
-    assert re.match(r'^[-+.() A-Za-z0-9]+$', tor_version)
+    assert _RE_TOR_VERSION.match(tor_version)
 
     return tor_version
 
 @chutney.Util.memoized
+@disk_memoized
 def get_torrc_options(tor):
     """Return the torrc options supported by the tor binary.
        Options are cached for each unique tor path.
     """
-    cmdline = [
-        tor,
-        "--list-torrc-options",
-    ]
-    opts = run_tor(cmdline)
+    opts = run_tor((tor, "--list-torrc-options"))
     # check we received a list of options, and nothing else
-    assert re.match(r'(^\w+$)+', opts, flags=re.MULTILINE)
+    assert _RE_TORRC_OPTS.match(opts)
     torrc_opts = opts.split()
 
     return torrc_opts
 
 @chutney.Util.memoized
+def get_lower_torrc_options(tor):
+    """Return a frozenset of the torrc options supported by the tor binary,
+       in lower case, for case-insensitive option checks.
+    """
+    return frozenset(opt.lower() for opt in get_torrc_options(tor))
+
+@chutney.Util.memoized
+@disk_memoized
 def get_tor_modules(tor):
     """Check the list of compile-time modules advertised by the given
        'tor' binary, and return a map from module name to a boolean
@@ -381,32 +760,92 @@ def get_tor_modules(tor):
        Unlisted modules are ones that Tor did not treat as compile-time
        optional modules.
     """
-    cmdline = [
-        tor,
-        "--list-modules",
-        "--quiet"
-        ]
     try:
-        mods = run_tor(cmdline)
+        mods = run_tor((tor, "--list-modules", "--quiet"))
     except subprocess.CalledProcessError:
         # Tor doesn't support --list-modules; act as if it said nothing.
         mods = ""
 
     supported = {}
     for line in mods.split("\n"):
-        m = re.match(r'^(\S+): (yes|no)', line)
+        m = _RE_MOD_LINE.match(line)
         if not m:
             continue
         supported[m.group(1)] = (m.group(2) == "yes")
 
     return supported
 
+def get_cert_fingerprint(certfile):
+    """Return the v3 identity fingerprint from the authority certificate
+       in certfile, or None if the certificate has no fingerprint line.
+
+       The certificate is small, so we read it in one go, and find the
+       fingerprint line without decoding or splitting the rest of the file.
+    """
+    with open(certfile, 'rb') as f:
+        data = f.read()
+    if data.startswith(b"fingerprint "):
+        start = 0
+    else:
+        start = data.find(b"\nfingerprint ") + 1
+        if start == 0:
+            return None
+    end = data.find(b"\n", start)
+    if end < 0:
+        end = len(data)
+    return data[start:end].split()[1].decode()
+
 def tor_has_module(tor, modname, default=True):
     """Return true iff the given tor binary supports a given compile-time
        module.  If the module is not listed, return 'default'.
     """
     return get_tor_modules(tor).get(modname, default)
 
+def prefetch_tor_info(tors, gencerts=()):
+    """Run the probes for each tor binary in tors, and each tor-gencert
+       binary in gencerts, in parallel, so that later calls to tor_exists(),
+       tor_gencert_exists(), get_tor_version(), get_torrc_options() and
+       get_tor_modules() are answered from their caches.
+
+       Only tor binaries that exist are probed for versions, options, and
+       modules, so that missing binaries are still reported by the caller.
+    """
+    tors = list(set(tors))
+    gencerts = list(set(g for g in gencerts if g))
+    if not tors and not gencerts:
+        return
+    max_workers = (os.cpu_count() or 1) * 2
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        exists = [pool.submit(tor_exists, tor) for tor in tors]
+        futures = [pool.submit(tor_gencert_exists, g) for g in gencerts]
+        for tor, f in zip(tors, exists):
+            if f.result():
+                futures += [pool.submit(probe, tor)
+                            for probe in (get_tor_version,
+                                          get_torrc_options,
+                                          get_tor_modules)]
+        # re-raise any exceptions (including SystemExit) in order
+        for f in futures:
+            f.result()
+    flush_tor_probe_cache()
+
+def prefetch_tor_versions(tors):
+    """Look up the version of each tor binary in tors in parallel, so that
+       later calls to get_tor_version() are answered from its cache.
+
+       Unlike prefetch_tor_info(), only versions are probed, so cached
+       versions don't need to run tor at all.
+    """
+    tors = list(set(tors))
+    if len(tors) <= 1:
+        # get_tor_version() will probe it when it's needed
+        return
+    with concurrent.futures.ThreadPoolExecutor(len(tors)) as pool:
+        # re-raise any exceptions (including SystemExit) in order
+        for f in [pool.submit(get_tor_version, tor) for tor in tors]:
+            f.result()
+    flush_tor_probe_cache()
+
 class Node(object):
 
     """A Node represents a Tor node or a set of Tor nodes.  It's created
@@ -432,15 +871,28 @@ class Node(object):
 
            Any fields not found there will be searched for in 'parent'.
         """
+        self._initFields(parent, self._createEnviron(parent, kwargs))
+
+    def _initFields(self, parent, env):
+        """Set this Node's fields, using env as its environment."""
         self._parent = parent
-        self._env = self._createEnviron(parent, kwargs)
+        self._env = env
         self._builder = None
         self._controller = None
 
     def getN(self, N):
         """Generate 'N' nodes of the same configuration as this node.
         """
-        return [Node(self) for _ in range(N)]
+        # All the new nodes have this node as their parent, and no
+        # overrides of their own, so skip the per-node kwargs handling
+        # and parent lookup in __init__.
+        parentenv = self._env
+        nodes = []
+        for _ in range(N):
+            node = Node.__new__(Node)
+            node._initFields(self, TorEnviron(parentenv))
+            nodes.append(node)
+        return nodes
 
     def specialize(self, **kwargs):
         """Return a new Node based on this node's value as its defaults,
@@ -453,7 +905,7 @@ class Node(object):
            runtime value of a key.  It should take a single argument, which
            will be an environment.
         """
-        setattr(self._env, "_get_"+key, fn)
+        self._env.set_runtime(key, fn)
 
     ######
     # Chutney uses these:
@@ -507,11 +959,27 @@ class _NodeCommon(object):
        and some NodeControllers."""
     # XXXX maybe this should turn into a mixin.
 
+    __slots__ = ('_env',)
+
+    # Templates shared by all nodes, keyed by (pattern, include path)
+    _TEMPLATE_CACHE = {}
+
     def __init__(self, env):
         self._env = env
 
+    def _getTemplate(self, pat, includePath=(".",)):
+        """Return a Template for pat and includePath, reusing one that we
+           have already made if possible."""
+        key = (pat, tuple(includePath))
+        template = _NodeCommon._TEMPLATE_CACHE.get(key)
+        if template is None:
+            template = chutney.Templating.Template(pat,
+                                                   includePath=includePath)
+            _NodeCommon._TEMPLATE_CACHE[key] = template
+        return template
+
     def expand(self, pat, includePath=(".",)):
-        return chutney.Templating.Template(pat, includePath).format(self._env)
+        return self._getTemplate(pat, includePath).format(self._env)
 
     def _getTorrcFname(self):
         """Return the name of the file where we'll be writing torrc"""
@@ -558,6 +1026,8 @@ class NodeController(_NodeCommon):
        node on the network.
     """
 
+    __slots__ = ()
+
     def __init__(self, env):
         _NodeCommon.__init__(self, env)
 
@@ -601,6 +1071,8 @@ class LocalNodeBuilder(NodeBuilder):
     # fingerprint, fingerprint_ed -- used only if authority
     # dirserver_flags -- used only if authority
     # nick -- nickname of this router
+    # force_keygen -- bool -- run tor to list fingerprints, even if we
+    #                 already have a key and fingerprint file
 
     # Environment members set
     # fingerprint -- hex router key fingerprint
@@ -611,59 +1083,60 @@ class LocalNodeBuilder(NodeBuilder):
         NodeBuilder.__init__(self, env)
         self._env = env
 
-    def _createTorrcFile(self, checkOnly=False):
+    def _createTorrcFile(self, checkOnly=False, net=None):
         """Write the torrc file for this node, disabling any options
            that are not supported by env's tor binary using comments.
            If checkOnly, just make sure that the formatting is indeed
            possible.
-        """
-        global torrc_option_warn_count
 
-        fn_out = self._getTorrcFname()
+           The torrc is written to a temporary file.  If net is None, it
+           is moved into place immediately.  Otherwise, net moves it into
+           place at the end of configure().
+        """
         torrc_template = self._getTorrcTemplate()
         output = torrc_template.format(self._env)
         if checkOnly:
-            # XXXX Is it time-consuming to format? If so, cache here.
             return
+        fn_out = self._getTorrcFname()
         # now filter the options we're about to write, commenting out
         # the options that the current tor binary doesn't support
         tor = self._env['tor']
         tor_version = get_tor_version(tor)
-        torrc_opts = get_torrc_options(tor)
+        # we need to do case-insensitive option comparison
+        lower_opts = get_lower_torrc_options(tor)
+        # the prefix is the same for every unsupported line in this torrc
+        comment_prefix = _UNSUPPORTED_OPTION_COMMENT.format(tor, tor_version)
         # check if each option is supported before writing it
         # Unsupported option values may need special handling.
-        with open(fn_out, 'w') as f:
-            # we need to do case-insensitive option comparison
-            lower_opts = [opt.lower() for opt in torrc_opts]
-            # keep ends when splitting lines, so we can write them out
-            # using writelines() without messing around with "\n"s
-            for line in output.splitlines(True):
-                # check if the first word on the line is a supported option,
-                # preserving empty lines and comment lines
-                sline = line.strip()
-                if (len(sline) == 0 or
-                        sline[0] == '#' or
-                        sline.split()[0].lower() in lower_opts):
-                    pass
-                else:
-                    warn_msg = (("The tor binary at {} does not support " +
-                                "the option in the torrc line:\n{}")
-                                .format(tor, line.strip()))
-                    if torrc_option_warn_count < TORRC_OPTION_WARN_LIMIT:
-                        print(warn_msg)
-                        torrc_option_warn_count += 1
-                    else:
-                        debug(warn_msg)
-                    # always dump the full output to the torrc file
-                    line = ("# {} version {} does not support: {}"
-                            .format(tor, tor_version, line))
-                f.writelines([line])
+        def filter_option(m):
+            global torrc_option_warn_count
+            # check if the first word on the line is a supported option
+            # (empty lines and comment lines never match _RE_OPTION_LINE)
+            line = m.group(0)
+            if m.group(1).lower() in lower_opts:
+                return line
+            if torrc_option_warn_count < TORRC_OPTION_WARN_LIMIT:
+                print(_UNSUPPORTED_OPTION_WARNING.format(tor, line.strip()))
+                torrc_option_warn_count += 1
+            elif debug_flag:
+                debug(_UNSUPPORTED_OPTION_WARNING.format(tor, line.strip()))
+            # always dump the full output to the torrc file
+            return comment_prefix + line
+        output = _RE_OPTION_LINE.sub(filter_option, output)
+        # write the whole torrc at once, once we've filtered it
+        tmp_fn_out = "%s.tmp" % (fn_out,)
+        if net is not None:
+            # add it first, so that net removes it if the write fails
+            net._addPendingWrite(tmp_fn_out, fn_out)
+        with open(tmp_fn_out, 'w') as f:
+            f.write(output)
+        if net is None:
+            os.replace(tmp_fn_out, fn_out)
 
     def _getTorrcTemplate(self):
         """Return the template used to write the torrc for this node."""
         template_path = self._env['torrc_template_path']
-        return chutney.Templating.Template("$${include:$torrc}",
-                                           includePath=template_path)
+        return self._getTemplate("$${include:$torrc}", template_path)
 
     def _getFreeVars(self):
         """Return a set of the free variables in the torrc template for this
@@ -681,17 +1154,25 @@ class LocalNodeBuilder(NodeBuilder):
         """Called on all nodes before any nodes configure: generates keys and
            hidden service directories as needed.
         """
+        self._warmCache()
         self._makeDataDir()
+        # launch all our key generation processes, then wait for them
+        auth_pending = None
+        router_pending = None
         if self._env['authority']:
-            self._genAuthorityKey()
+            auth_pending = self._spawnAuthorityKey()
         if self._env['relay']:
-            self._genRouterKey()
+            router_pending = self._spawnRouterKey()
+        if auth_pending is not None:
+            self._finishAuthorityKey(auth_pending)
+        if router_pending is not None:
+            self._finishRouterKey(router_pending)
         if self._env['hs']:
             self._makeHiddenServiceDir()
 
     def config(self, net):
         """Called to configure a node: creates a torrc file for it."""
-        self._createTorrcFile()
+        self._createTorrcFile(net=net)
         # self._createScripts()
 
     def postConfig(self, net):
@@ -703,16 +1184,39 @@ class LocalNodeBuilder(NodeBuilder):
         """Return true if this node appears to have everything it needs;
            false otherwise."""
 
-        if not tor_exists(self._env['tor']):
-            print("No binary found for %r"%self._env['tor'])
+        # Network.supported() probes every binary in parallel first, so
+        # these checks are answered from the probe caches.
+        tor = self._env['tor']
+        if not tor_exists(tor):
+            print("No binary found for %r"%tor)
             return False
 
         if self._env['authority']:
-            if not tor_has_module(self._env['tor'], "dirauth"):
-                print("No dirauth support in %r"%self._env['tor'])
+            if not tor_has_module(tor, "dirauth"):
+                print("No dirauth support in %r"%tor)
+                return False
+            tor_gencert = self._env['tor_gencert']
+            if not tor_gencert_exists(tor_gencert):
+                print("No binary found for tor-gencert %r"%tor_gencert)
                 return False
-            if not tor_gencert_exists(self._env['tor-gencert']):
-                print("No binary found for tor-gencert %r"%self._env['tor-gencert'])
+
+        return True
+
+    # The files in an authority's keys directory that tor-gencert creates
+    _AUTHORITY_KEY_FILES = frozenset(("authority_identity_key",
+                                      "authority_signing_key",
+                                      "authority_certificate"))
+
+    # Computed Environ fields that don't change after the node is numbered
+    _WARM_FIELDS = ('dir', 'nick', 'orport', 'dirport', 'controlport',
+                    'socksport', 'tor_gencert')
+
+    def _warmCache(self):
+        """Store the values of our computed fields in our Environ, so that
+           torrc expansion doesn't recompute them through the parent chain.
+        """
+        for key in LocalNodeBuilder._WARM_FIELDS:
+            self._env[key] = self._env[key]
 
     def _makeDataDir(self):
         """Create the data directory (with keys subdirectory) for this node.
@@ -730,26 +1234,37 @@ class LocalNodeBuilder(NodeBuilder):
         datadir = self._env['dir']
         make_datadir_subdirectory(datadir, self._env['hs_directory'])
 
-    def _genAuthorityKey(self):
-        """Generate an authority identity and signing key for this authority,
-           if they do not already exist."""
+    def _spawnAuthorityKey(self):
+        """Launch tor-gencert to generate an authority identity and signing
+           key for this authority, if they do not already exist.
+
+           Returns a (process, passphrase) tuple to pass to
+           _finishAuthorityKey(), or None if the keys already exist.
+        """
         datadir = self._env['dir']
+        keydir = os.path.join(datadir, 'keys')
+        # check for all the key files with one directory listing, before
+        # doing any other work
+        try:
+            keyfiles = frozenset(os.listdir(keydir))
+        except OSError:
+            keyfiles = frozenset()
+        if LocalNodeBuilder._AUTHORITY_KEY_FILES <= keyfiles:
+            return
         tor_gencert = self._env['tor_gencert']
         lifetime = self._env['auth_cert_lifetime']
-        idfile = Path(datadir, 'keys', "authority_identity_key")
-        skfile = Path(datadir, 'keys', "authority_signing_key")
-        certfile = Path(datadir, 'keys', "authority_certificate")
+        idfile = os.path.join(keydir, "authority_identity_key")
+        skfile = os.path.join(keydir, "authority_signing_key")
+        certfile = os.path.join(keydir, "authority_certificate")
         addr = self.expand("${ip}:${dirport}")
         passphrase = self._env['auth_passphrase']
-        if all(f.exists() for f in [idfile, skfile, certfile]):
-            return
         cmdline = [
             tor_gencert,
             '--create-identity-key',
             '--passphrase-fd', '0',
-            '-i', str(idfile),
-            '-s', str(skfile),
-            '-c', str(certfile),
+            '-i', idfile,
+            '-s', skfile,
+            '-c', certfile,
             '-m', str(lifetime),
             '-a', addr,
             ]
@@ -758,12 +1273,29 @@ class LocalNodeBuilder(NodeBuilder):
               .format(self._env['nick'], cmdline[0]))
         debug("Identity key path '{}', command '{}'"
               .format(idfile, " ".join(cmdline)))
-        run_tor_gencert(cmdline, passphrase)
+        p = launch_process(cmdline,
+                           tor_name="tor-gencert",
+                           stdin=subprocess.PIPE)
+        return (p, passphrase)
+
+    def _finishAuthorityKey(self, pending):
+        """Wait for the tor-gencert process started by _spawnAuthorityKey()
+           to finish.
+        """
+        (p, passphrase) = pending
+        wait_tor_gencert(p, passphrase)
 
-    def _genRouterKey(self):
-        """Generate an identity key for this router, unless we already have,
-           and set up the 'fingerprint' entry in the Environ.
+    def _spawnRouterKey(self):
+        """Launch tor to list the fingerprint of this router, generating an
+           identity key if we don't already have one.
+
+           Returns a (process, cmdline) tuple to pass to _finishRouterKey().
+           If we already have a key and its fingerprint, and force_keygen
+           is not set, sets up the 'fingerprint' entries in the Environ,
+           and returns None.
         """
+        if not self._env['force_keygen'] and self._loadRouterKey():
+            return None
         datadir = self._env['dir']
         tor = self._env['tor']
         torrc = self._getTorrcFname()
@@ -775,14 +1307,55 @@ class LocalNodeBuilder(NodeBuilder):
             "--datadirectory", datadir,
             "--list-fingerprint",
             ]
-        stdouterr = run_tor(cmdline)
-        fingerprint = "".join((stdouterr.rstrip().split('\n')[-1]).split()[1:])
-        if not re.match(r'^[A-F0-9]{40}$', fingerprint):
+        p = launch_process(cmdline)
+        return (p, cmdline)
+
+    def _finishRouterKey(self, pending):
+        """Wait for the tor process started by _spawnRouterKey() to finish,
+           and set up the 'fingerprint' entries in the Environ.
+        """
+        (p, cmdline) = pending
+        (stdouterr, empty_stderr) = p.communicate()
+        debug(stdouterr)
+        assert empty_stderr is None
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmdline,
+                                                output=stdouterr)
+        # the fingerprint is on the last line, after the nickname
+        output = stdouterr.rstrip()
+        last_line = output[output.rfind('\n') + 1:]
+        fingerprint = "".join(last_line.split()[1:])
+        if not _isFingerprint(fingerprint):
             print("Error when getting fingerprint using '{0}'. It output '{1}'."
                   .format(repr(" ".join(cmdline)), repr(stdouterr)))
             sys.exit(1)
         self._env['fingerprint'] = fingerprint
+        self._loadEd25519Fingerprint()
 
+    def _loadRouterKey(self):
+        """If tor has already generated an identity key and fingerprint
+           file for this router, set up the 'fingerprint' entries in the
+           Environ from those files, and return True.  Otherwise, return
+           False.
+        """
+        datadir = self._env['dir']
+        idfile = os.path.join(datadir, "keys", "secret_id_key")
+        fpfile = os.path.join(datadir, "fingerprint")
+        if not (os.path.exists(idfile) and os.path.exists(fpfile)):
+            return False
+        with open(fpfile) as f:
+            words = f.read().split()
+        if len(words) < 2 or not _isFingerprint(words[1]):
+            return False
+        self._env['fingerprint'] = words[1]
+        self._loadEd25519Fingerprint()
+        return True
+
+    def _loadEd25519Fingerprint(self):
+        """Set the 'fingerprint_ed25519' entry in the Environ from the file
+           written by tor, or to "" if there is no such file.
+        """
+        datadir = self._env['dir']
         ed_fn = os.path.join(datadir, "fingerprint-ed25519")
         if os.path.exists(ed_fn):
             s = open(ed_fn).read().strip().split()[1]
@@ -806,14 +1379,8 @@ class LocalNodeBuilder(NodeBuilder):
             return ("",("", ""))
 
         datadir = self._env['dir']
-        certfile = Path(datadir, 'keys', "authority_certificate")
-        v3id = None
-        with certfile.open(mode='r') as f:
-            for line in f:
-                if line.startswith("fingerprint"):
-                    v3id = line.split()[1].strip()
-                    break
-
+        certfile = os.path.join(datadir, 'keys', "authority_certificate")
+        v3id = get_cert_fingerprint(certfile)
         assert v3id is not None
 
         if self._env['bridgeauthority']:
@@ -834,36 +1401,36 @@ class LocalNodeBuilder(NodeBuilder):
             self._env['dirserver_flags'] += " v3ident=%s" % v3id
             arti = True
 
-        authlines = ""
-        for authopt in options:
-            authlines += "%s %s orport=%s" % (
-                authopt, self._env['nick'], self._env['orport'])
-            # It's ok to give an authority's IPv6 address to an IPv4-only
-            # client or relay: it will and must ignore it
-            # and yes, the orport is the same on IPv4 and IPv6
-            if self._env['ipv6_addr'] is not None:
-                authlines += " ipv6=%s:%s" % (self._env['ipv6_addr'],
-                                              self._env['orport'])
-            authlines += " %s %s:%s %s\n" % (
-                self._env['dirserver_flags'], self._env['ip'],
-                self._env['dirport'], self._env['fingerprint'])
+        nick = self._env['nick']
+        orport = self._env['orport']
+        ipv6_addr = self._env['ipv6_addr']
+        # It's ok to give an authority's IPv6 address to an IPv4-only
+        # client or relay: it will and must ignore it
+        # and yes, the orport is the same on IPv4 and IPv6
+        if ipv6_addr is not None:
+            ipv6_part = " ipv6=%s:%s" % (ipv6_addr, orport)
+        else:
+            ipv6_part = ""
+        # Everything after the option name is the same for each option
+        authline = "%s orport=%s%s %s %s:%s %s\n" % (
+            nick, orport, ipv6_part, self._env['dirserver_flags'],
+            self._env['ip'], self._env['dirport'], self._env['fingerprint'])
+        authlines = "".join("%s %s" % (authopt, authline)
+                            for authopt in options)
 
         # generate arti configuartion if supported
         arti_lines = ("","")
         if arti:
-            addrs = '"%s:%s"' % (self._env['ip'], self._env['orport'])
-            if self._env['ipv6_addr'] is not None:
-                addrs += ', "%s:%s"' % (self._env['ipv6_addr'],
-                                        self._env['orport'])
-            elts = { "fp": self._env['fingerprint'].replace(" ", ""),
-                     "ed_fp": self._env['fingerprint_ed25519'],
-                     "orports": addrs,
-                     "nick": self._env['nick'],
-                     "v3id": v3id }
+            addrs = '"%s:%s"' % (self._env['ip'], orport)
+            if ipv6_addr is not None:
+                addrs += ', "%s:%s"' % (ipv6_addr, orport)
+            fp = self._env['fingerprint'].replace(" ", "")
+            ed_fp = self._env['fingerprint_ed25519']
             arti_lines = (
-                    """    {{rsa_identity = "{fp}", ed_identity = "{ed_fp}", orports = [{orports}]}},\n""".format(**elts),
-                    """    {{name = "{nick}", v3ident = "{v3id}"}},\n""".format(**elts),
-                    )
+                f'    {{rsa_identity = "{fp}", ed_identity = "{ed_fp}", '
+                f'orports = [{addrs}]}},\n',
+                f'    {{name = "{nick}", v3ident = "{v3id}"}},\n',
+                )
         return (authlines, arti_lines)
 
     def _getBridgeLines(self):
@@ -883,29 +1450,110 @@ class LocalNodeBuilder(NodeBuilder):
             transport = ""
             extra = ""
 
-        BRIDGE_LINE_TEMPLATE = "Bridge %s %s:%s %s %s\n"
-
-        bridgelines = BRIDGE_LINE_TEMPLATE % (transport,
-                                              self._env['ip'],
-                                              port,
-                                              self._env['fingerprint'],
-                                              extra)
+        # Only the address differs between the IPv4 and IPv6 lines
+        addrs = [self._env['ip']]
         if self._env['ipv6_addr'] is not None:
-            bridgelines += BRIDGE_LINE_TEMPLATE % (transport,
-                                                   self._env['ipv6_addr'],
-                                                   port,
-                                                   self._env['fingerprint'],
-                                                   extra)
-        return bridgelines
+            addrs.append(self._env['ipv6_addr'])
+        line_end = ":%s %s %s\n" % (port, self._env['fingerprint'], extra)
+        return "".join("Bridge %s %s%s" % (transport, addr, line_end)
+                       for addr in addrs)
 
 
+# The directory status keys that LocalNodeController combines when
+# summarising the directory statuses for each other node
+_DESC_ALTS_KEYS = frozenset(("desc", "desc_new"))
+_MD_ALTS_KEYS = frozenset(("md", "md_new"))
+_CONS_KEYS = frozenset(("ns_cons", "md_cons"))
+_DESC_ALL_KEYS = frozenset(("desc_alts", "md_alts"))
+_NODE_DIR_KEYS = frozenset(("cons_all", "br_status", "desc_all"))
+
 class LocalNodeController(NodeController):
 
+    # There is one controller per node, and they are polled many times
+    # while we wait for bootstrap, so we don't give them instance dicts.
+    # (See __init__ for what these fields are.)
+    __slots__ = ('most_recent_oniondesc_status',
+                 'most_recent_bootstrap_status',
+                 '_oniondesc_log_offset',
+                 '_bootstrap_log_offset',
+                 '_run_as_daemon',
+                 '_legacy_tor_version',
+                 '_dir_matchers',
+                 '_is_bridge',
+                 '_is_bridge_client',
+                 '_is_bridge_authority',
+                 '_is_authority',
+                 '_is_relay',
+                 '_is_onion_service',
+                 '_is_consensus_authority',
+                 '_is_consensus_member',
+                 '_datadir',
+                 '_pidfile',
+                 '_lockfile',
+                 '_notice_log',
+                 '_info_log',
+                 '_ed25519_id',
+                 '_pid',
+                 '_pidfd',
+                 '_cache_dir_info_paths',
+                 '_dir_file_statuses')
+
     def __init__(self, env):
         NodeController.__init__(self, env)
         self._env = env
         self.most_recent_oniondesc_status = None
         self.most_recent_bootstrap_status = None
+        # How far we have scanned through our logs, in bytes
+        self._oniondesc_log_offset = 0
+        self._bootstrap_log_offset = 0
+        # Whether our torrc sets RunAsDaemon 1, or None if we haven't
+        # read the torrc yet
+        self._run_as_daemon = None
+        # Whether our tor is older than MIN_TOR_VERSION_FOR_TIMING_FIX, or
+        # None if we haven't checked yet
+        self._legacy_tor_version = None
+        # A map from dir_format to our dir info status matcher
+        self._dir_matchers = {}
+        # Our role flags, which are set when the node is created, and
+        # checked many times during each status update
+        self._is_bridge = self._getEnvFlag('bridge')
+        self._is_bridge_client = self._getEnvFlag('bridgeclient')
+        self._is_bridge_authority = self._getEnvFlag('bridgeauthority')
+        self._is_authority = self._getEnvFlag('authority')
+        self._is_relay = self._getEnvFlag('relay')
+        self._is_onion_service = (env['tag'].startswith('h') or
+                                  self._getEnvFlag('hs'))
+        # Derived roles, see the accessors for details
+        self._is_consensus_authority = (self._is_authority and
+                                        not self._is_bridge_authority)
+        self._is_consensus_member = self._is_relay and not self._is_bridge
+        # The files we check during each status update
+        self._datadir = env['dir']
+        self._pidfile = Path(env['pidfile'])
+        self._lockfile = Path(env['lockfile'])
+        self._notice_log = Path(self._datadir, "notice.log")
+        self._info_log = Path(self._datadir, "info.log")
+        # The pid in our pidfile, or None if we haven't read it
+        self._pid = None
+        # A (pid, pidfd) tuple for our process, or None if we haven't
+        # opened a pidfd
+        self._pidfd = None
+        # Our base64-encoded ed25519 identity, or None if we haven't read it
+        self._ed25519_id = None
+        # A map from v2_dir_paths to the result of getNodeCacheDirInfoPaths()
+        self._cache_dir_info_paths = {}
+        # A map from (dir_format, dir_path) to a (file id, status code,
+        # status message) tuple, for getFileDirInfoStatus()
+        self._dir_file_statuses = {}
+
+    def _getEnvFlag(self, key):
+        """Return the boolean value of the flag key in our environment,
+           or False if it is not set.
+        """
+        try:
+            return bool(self._env[key])
+        except KeyError:
+            return False
 
     def _loadEd25519Id(self):
         """
@@ -916,39 +1564,41 @@ class LocalNodeController(NodeController):
 
            Raises a ValueError if the file appears to be corrupt.
         """
-        datadir = self._env['dir']
-        key_file = Path(datadir, 'keys', 'ed25519_master_id_public_key')
+        key_file = os.path.join(self._datadir, 'keys',
+                                'ed25519_master_id_public_key')
+        EXPECTED_ED25519_FILE_SIZE = 64
         # If we're called early during bootstrap, the file won't have been
         # created yet. (And some very old tor versions don't have ed25519.)
-        if not key_file.exists():
+        try:
+            fd = os.open(key_file, os.O_RDONLY)
+        except FileNotFoundError:
             debug(("File {} does not exist. Are you running a very old tor "
                    "version?").format(key_file))
             return None
-
-        EXPECTED_ED25519_FILE_SIZE = 64
-        key_file_size = key_file.stat().st_size
-        if key_file_size != EXPECTED_ED25519_FILE_SIZE:
-            raise ValueError(
-                ("The current size of the file is {} bytes, which is not"
-                 "matching the expected value of {} bytes")
-                .format(key_file_size, EXPECTED_ED25519_FILE_SIZE))
-
-        with key_file.open(mode='rb') as f:
-            ED25519_KEY_POSITION = 32
-            f.seek(ED25519_KEY_POSITION)
-            rest_file = f.read()
-            encoded_value = base64.b64encode(rest_file)
-            # tor strips trailing base64 padding
-            ed25519_id = encoded_value.decode('utf-8').replace('=', '')
-            EXPECTED_ED25519_BASE64_KEY_SIZE = 43
-            key_base64_size = len(ed25519_id)
-            if (key_base64_size != EXPECTED_ED25519_BASE64_KEY_SIZE):
+        try:
+            # read one extra byte, so we notice files that are too long
+            data = os.read(fd, EXPECTED_ED25519_FILE_SIZE + 1)
+            if len(data) != EXPECTED_ED25519_FILE_SIZE:
                 raise ValueError(
-                    ("The current length of the key is {}, which is not "
-                     "matching the expected length of {}")
-                    .format(key_base64_size,
-                            EXPECTED_ED25519_BASE64_KEY_SIZE))
-            return ed25519_id
+                    ("The current size of the file is {} bytes, which is not"
+                     "matching the expected value of {} bytes")
+                    .format(os.fstat(fd).st_size, EXPECTED_ED25519_FILE_SIZE))
+        finally:
+            os.close(fd)
+
+        ED25519_KEY_POSITION = 32
+        encoded_value = base64.b64encode(data[ED25519_KEY_POSITION:])
+        # tor strips trailing base64 padding
+        ed25519_id = encoded_value.decode('utf-8').replace('=', '')
+        EXPECTED_ED25519_BASE64_KEY_SIZE = 43
+        key_base64_size = len(ed25519_id)
+        if (key_base64_size != EXPECTED_ED25519_BASE64_KEY_SIZE):
+            raise ValueError(
+                ("The current length of the key is {}, which is not "
+                 "matching the expected length of {}")
+                .format(key_base64_size,
+                        EXPECTED_ED25519_BASE64_KEY_SIZE))
+        return ed25519_id
 
     def getNick(self):
         """Return the nickname for this node."""
@@ -956,75 +1606,51 @@ class LocalNodeController(NodeController):
 
     def getBridge(self):
         """Return the bridge (relay) flag for this node."""
-        try:
-            return self._env['bridge']
-        except KeyError:
-            return 0
+        return self._is_bridge
 
     def getEd25519Id(self):
         """Return the base64-encoded ed25519 public key of this node."""
-        try:
-            return self._env['ed25519_id']
-        except KeyError:
-            ed25519_id = self._loadEd25519Id()
-            # cache a copy for later
-            if ed25519_id:
-                self._env['ed25519_id'] = ed25519_id
-            return ed25519_id
+        if self._ed25519_id is None:
+            # cache a copy for later, but keep looking for the key until
+            # tor has written it
+            self._ed25519_id = self._loadEd25519Id()
+        return self._ed25519_id
 
     def getBridgeClient(self):
         """Return the bridge client flag for this node."""
-        try:
-            return self._env['bridgeclient']
-        except KeyError:
-            return 0
+        return self._is_bridge_client
 
     def getBridgeAuthority(self):
         """Return the bridge authority flag for this node."""
-        try:
-            return self._env['bridgeauthority']
-        except KeyError:
-            return 0
+        return self._is_bridge_authority
 
     def getAuthority(self):
         """Return the authority flag for this node."""
-        try:
-            return self._env['authority']
-        except KeyError:
-            return 0
+        return self._is_authority
 
     def getConsensusAuthority(self):
         """Is this node a consensus (V2 directory) authority?"""
-        return self.getAuthority() and not self.getBridgeAuthority()
+        return self._is_consensus_authority
 
     def getConsensusMember(self):
         """Is this node listed in the consensus?"""
-        return self.getDirServer() and not self.getBridge()
+        return self._is_consensus_member
 
     def getDirServer(self):
         """Return the relay flag for this node.
            The relay flag is set on authorities, relays, and bridges.
         """
-        try:
-            return self._env['relay']
-        except KeyError:
-            return 0
+        return self._is_relay
 
     def getConsensusRelay(self):
         """Is this node published in the consensus?
            True for authorities and relays; False for bridges and clients.
         """
-        return self.getDirServer() and not self.getBridge()
+        return self._is_consensus_member
 
     def isOnionService(self):
         """Is this node an onion service?"""
-        if self._env['tag'].startswith('h'):
-            return 1
-
-        try:
-            return self._env['hs']
-        except KeyError:
-            return 0
+        return self._is_onion_service
 
     # By default, there is no minimum start time.
     MIN_START_TIME_DEFAULT = 0
@@ -1052,6 +1678,8 @@ class LocalNodeController(NodeController):
 
     def isLegacyTorVersion(self):
         """Is the current Tor version 0.3.5 or earlier?"""
+        if self._legacy_tor_version is not None:
+            return self._legacy_tor_version
         tor = self._env['tor']
         tor_version = get_tor_version(tor)
         min_version = LocalNodeController.MIN_TOR_VERSION_FOR_TIMING_FIX
@@ -1059,10 +1687,9 @@ class LocalNodeController(NodeController):
         # We could compare the version components, but this works for now
         # (And if it's a custom Tor implementation, it shouldn't have this
         # particular timing bug.)
-        if tor_version.startswith('Tor ') and tor_version < min_version:
-            return True
-        else:
-            return False
+        self._legacy_tor_version = (tor_version.startswith('Tor ') and
+                                    tor_version < min_version)
+        return self._legacy_tor_version
 
     # The extra time after other descriptors have finished, and before
     # verifying.
@@ -1096,16 +1723,58 @@ class LocalNodeController(NodeController):
     def getPid(self):
         """Read the pidfile, and return the pid of the running process.
            Returns None if there is no pid in the file.
+
+           The pid is cached until isRunning() sees that the process has
+           exited, or we start the node again.
         """
-        pidfile = Path(self._env['pidfile'])
-        if not pidfile.exists():
-            return None
+        if self._pid is None:
+            self._pid = self._readPidfile()
+        return self._pid
 
-        with pidfile.open(mode='r') as f:
-            try:
-                return int(f.read())
-            except ValueError:
+    def getPidfd(self):
+        """Return a pidfd for our running process, or None if there is no
+           pid, or we can't open a pidfd for it.
+
+           The pidfd is owned by this controller, and it is closed when we
+           forget our pid.
+        """
+        pid = self.getPid()
+        if pid is None:
+            return None
+        if self._pidfd is None or self._pidfd[0] != pid:
+            self._forgetPidfd()
+            pidfd = open_pidfd(pid)
+            if pidfd is None:
                 return None
+            self._pidfd = (pid, pidfd)
+        return self._pidfd[1]
+
+    def _forgetPid(self):
+        """Forget our cached pid and pidfd, so we read the pidfile again."""
+        self._pid = None
+        self._forgetPidfd()
+
+    def _forgetPidfd(self):
+        """Close our cached pidfd, if we have one."""
+        if self._pidfd is not None:
+            os.close(self._pidfd[1])
+            self._pidfd = None
+
+    def _readPidfile(self):
+        """Return the pid in our pidfile, or None if there is no pid."""
+        try:
+            fd = os.open(self._pidfile, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            # a pid, and a newline
+            data = os.read(fd, 32)
+        finally:
+            os.close(fd)
+        try:
+            return int(data)
+        except ValueError:
+            return None
 
     def isRunning(self, pid=None):
         """Return true iff this node is running.  (If 'pid' is provided, we
@@ -1117,12 +1786,24 @@ class LocalNodeController(NodeController):
         if pid is None:
             return False
 
-        try:
-            os.kill(pid, 0)  # "kill 0" == "are you there?"
-        except OSError as e:
-            if e.errno == errno.ESRCH:
-                return False
-            raise
+        live_pids = get_live_pids()
+        if live_pids is not None:
+            # "listed in /proc" == "are you there?"
+            running = pid in live_pids
+        else:
+            try:
+                os.kill(pid, 0)  # "kill 0" == "are you there?"
+                running = True
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+                running = False
+
+        if not running:
+            if pid == self._pid:
+                # our process has exited, so read the pidfile next time
+                self._forgetPid()
+            return False
 
         # okay, so the process exists.  Say "True" for now.
         # XXXX check if this is really tor!
@@ -1135,10 +1816,20 @@ class LocalNodeController(NodeController):
            If it's crashed, print a statement.  Return True if the
            node is running, false otherwise.
         """
-        # XXX Split this into "check" and "print" parts.
+        (running, check_msg) = self.getCheckStatus(listRunning,
+                                                   listNonRunning)
+        if check_msg:
+            print(check_msg)
+        return running
+
+    def getCheckStatus(self, listRunning=True, listNonRunning=False):
+        """See if this node is running, stopped, or crashed.  Returns a
+           (running, message) tuple, where running is True if the node is
+           running, and message is the statement check() would print, or
+           None if it would not print anything.
+        """
         pid = self.getPid()
         nick = self._env['nick']
-        datadir = self._env['dir']
         corefile = None
         if pid:
             corefile = "core.%d" % pid
@@ -1146,19 +1837,21 @@ class LocalNodeController(NodeController):
         if self.isRunning(pid):
             if listRunning:
                 # PIDs are typically 65535 or less
-                print("{:12} is running with PID {:5}: {}"
-                      .format(nick, pid, tor_version))
-            return True
-        elif corefile and Path(datadir, corefile).exists():
+                return (True, "{:12} is running with PID {:5}: {}"
+                              .format(nick, pid, tor_version))
+            return (True, None)
+        elif corefile and os.path.exists(os.path.join(self._datadir,
+                                                      corefile)):
             if listNonRunning:
-                print("{:12} seems to have crashed, and left core file {}: {}"
-                      .format(nick, corefile, tor_version))
-            return False
+                return (False,
+                        "{:12} seems to have crashed, and left core file {}: {}"
+                        .format(nick, corefile, tor_version))
+            return (False, None)
         else:
             if listNonRunning:
-                print("{:12} is stopped: {}"
-                      .format(nick, tor_version))
-            return False
+                return (False, "{:12} is stopped: {}"
+                               .format(nick, tor_version))
+            return (False, None)
 
     def hup(self):
         """Send a SIGHUP to this node, if it's running."""
@@ -1205,6 +1898,9 @@ class LocalNodeController(NodeController):
             sys.stdout.flush()
             time.sleep(self._env['poll_launch_time'])
             p.poll()
+        # tor may have daemonised into a new process
+        invalidate_live_pids()
+        self._forgetPid()
         if p.returncode is not None and p.returncode != 0:
             if self._env['poll_launch_time'] is None:
                 print(("Couldn't launch {:12} command '{}': " +
@@ -1225,49 +1921,72 @@ class LocalNodeController(NodeController):
 
     def stop(self, sig=signal.SIGINT):
         """Try to stop this node by sending it the signal 'sig'."""
-        pid = self.getPid()
-        if not self.isRunning(pid):
+        if not self.sendSignal(sig):
             print("{:12} is not running".format(self._env['nick']))
-            return
-        os.kill(pid, sig)
 
-    def cleanup_lockfile(self):
-        """Remove lock file if this node is no longer running."""
-        lf = Path(self._env['lockfile'])
-        if not self.isRunning() and lf.exists():
-            debug("Removing stale lock file for {} ..."
-                  .format(self._env['nick']))
-            os.remove(lf)
+    def sendSignal(self, sig):
+        """Send the signal 'sig' to this node, if it's running.  Return True
+           if we sent the signal, and False if the node isn't running.
+
+           We don't check if the node is running first: the kill() fails if
+           the process has exited.
+        """
+        pid = self.getPid()
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            # our process has exited, so read the pidfile next time
+            self._forgetPid()
+            return False
+        invalidate_live_pids()
+        return True
+
+    def cleanup_lockfile(self, pid=None):
+        """Remove lock file if this node is no longer running.  (If 'pid'
+           is provided, it is passed to isRunning().)
+        """
+        if self.isRunning(pid):
+            return
+        # try to remove the file, rather than checking if it exists first
+        try:
+            self._lockfile.unlink()
+        except FileNotFoundError:
+            return
+        debug("Removed stale lock file for {}"
+              .format(self._env['nick']))
 
-    def cleanup_pidfile(self):
+    def cleanup_pidfile(self, pid=None):
         """Move PID file to pidfile.old if this node is no longer running
-           so that we don't try to stop the node again.
+           so that we don't try to stop the node again.  (If 'pid' is
+           provided, it is passed to isRunning().)
         """
-        pidfile = Path(self._env['pidfile'])
-        if not self.isRunning() and pidfile.exists():
-            debug("Renaming stale pid file for {} ..."
-                  .format(self._env['nick']))
-            pidfile.rename(pidfile.with_suffix(".old"))
+        if self.isRunning(pid):
+            return
+        try:
+            self._pidfile.rename(self._pidfile.with_suffix(".old"))
+        except FileNotFoundError:
+            return
+        debug("Renamed stale pid file for {}"
+              .format(self._env['nick']))
+        self._forgetPid()
 
     def waitOnLaunch(self):
         """Check whether we can wait() for the tor process to launch"""
         # TODO: is this the best place for this code?
-        # RunAsDaemon default is 0
-        runAsDaemon = False
-        with open(self._getTorrcFname(), 'r') as f:
-            for line in f.readlines():
-                stline = line.strip()
-                # if the line isn't all whitespace or blank
-                if len(stline) > 0:
-                    splline = stline.split()
-                    # if the line has at least two tokens on it
-                    if (len(splline) > 0 and
-                            splline[0].lower() == "RunAsDaemon".lower() and
-                            splline[1] == "1"):
+        if self._run_as_daemon is None:
+            # RunAsDaemon default is 0
+            runAsDaemon = False
+            with open(self._getTorrcFname(), 'r') as f:
+                for line in f:
+                    if _RE_RUN_AS_DAEMON.match(line):
                         # use the RunAsDaemon value from the torrc
                         # TODO: multiple values?
                         runAsDaemon = True
-        if runAsDaemon:
+                        break
+            self._run_as_daemon = runAsDaemon
+        if self._run_as_daemon:
             # we must use wait() instead of poll()
             self._env['poll_launch_time'] = None
             return True
@@ -1280,12 +1999,10 @@ class LocalNodeController(NodeController):
 
     def getLogfile(self, info=False):
         """Return the expected path to the logfile for this instance."""
-        datadir = self._env['dir']
         if info:
-            logname = "info.log"
+            return self._info_log
         else:
-            logname = "notice.log"
-        return Path(datadir, logname)
+            return self._notice_log
 
     INTERNAL_ERROR_CODE = -500
     MISSING_FILE_CODE = -400
@@ -1303,30 +2020,37 @@ class LocalNodeController(NodeController):
            descriptor status received.
         """
         logfname = self.getLogfile(info=True)
-        if not os.path.exists(logfname):
+        try:
+            log_size = os.stat(logfname).st_size
+        except FileNotFoundError:
             return (LocalNodeController.MISSING_FILE_CODE,
                     "no_logfile", "There is no logfile yet.")
-        percent = LocalNodeController.NO_RECORDS_CODE
-        keyword = "no_message"
-        message = "No onion service descriptor messages yet."
-        with open(logfname, 'r') as f:
-            for line in f:
-                m_v2 = re.search(r'Launching upload for hidden service (.*)',
-                                 line)
-                if m_v2:
-                    percent = LocalNodeController.ONIONDESC_PUBLISHED_CODE
-                    keyword = LocalNodeController.HSV2_KEYWORD
-                    message = m_v2.groups()[0]
-                    break
-                # else check for HSv3
-                m_v3 = re.search(r'Service ([^\s]+ [^\s]+ descriptor of revision .*)',
-                                 line)
-                if m_v3:
-                    percent = LocalNodeController.ONIONDESC_PUBLISHED_CODE
-                    keyword = LocalNodeController.HSV3_KEYWORD
-                    message = m_v3.groups()[0]
-                    break
-        self.most_recent_oniondesc_status = (percent, keyword, message)
+        if (self.most_recent_oniondesc_status is not None and
+                self.most_recent_oniondesc_status[0] ==
+                LocalNodeController.ONIONDESC_PUBLISHED_CODE and
+                log_size >= self._oniondesc_log_offset):
+            # we already have the first descriptor message, and tor hasn't
+            # restarted, so there's no need to read the rest of the log
+            return
+        (data, self._oniondesc_log_offset, restarted) = _readAppendedLines(
+            logfname, self._oniondesc_log_offset)
+        if restarted or self.most_recent_oniondesc_status is None:
+            self.most_recent_oniondesc_status = (
+                LocalNodeController.NO_RECORDS_CODE,
+                "no_message",
+                "No onion service descriptor messages yet.")
+        # find the first HSv2 or HSv3 descriptor message
+        m = _RE_ONIONDESC.search(data)
+        if m:
+            (v2_message, v3_message) = m.groups()
+            percent = LocalNodeController.ONIONDESC_PUBLISHED_CODE
+            if v2_message is not None:
+                keyword = LocalNodeController.HSV2_KEYWORD
+                message = _decodeLog(v2_message)
+            else:
+                keyword = LocalNodeController.HSV3_KEYWORD
+                message = _decodeLog(v3_message)
+            self.most_recent_oniondesc_status = (percent, keyword, message)
 
     def getLastOnionServiceDescStatus(self):
         """Return the last onion descriptor message fetched by
@@ -1335,6 +2059,8 @@ class LocalNodeController(NodeController):
 
            The return status depends on the last time updateLastStatus()
            was called; that function must be called before this one.
+           updateLastStatus() only updates onion services, so other nodes
+           return None.
         """
         return self.most_recent_oniondesc_status
 
@@ -1343,20 +2069,39 @@ class LocalNodeController(NodeController):
            received.
         """
         logfname = self.getLogfile()
-        if not logfname.exists():
+        if not os.path.exists(logfname):
             return (LocalNodeController.MISSING_FILE_CODE,
                     "no_logfile", "There is no logfile yet.")
-        percent = LocalNodeController.NO_RECORDS_CODE
-        keyword = "no_message"
-        message = "No bootstrap messages yet."
-        with logfname.open(mode='r') as f:
-            for line in f:
-                m = re.search(r'Bootstrapped (\d+)%(?: \(([^\)]*)\))?: (.*)',
-                              line)
+        groups = None
+        if self._bootstrap_log_offset > 0:
+            (data, offset, restarted) = _readAppendedLines(
+                logfname, self._bootstrap_log_offset)
+            if not restarted:
+                self._bootstrap_log_offset = offset
+                # we want the last bootstrap message, but we keep the
+                # previous one if no new messages have been logged since
+                # our last scan
+                m = None
+                for m in _RE_BOOTSTRAP.finditer(data):
+                    pass
                 if m:
-                    percent, keyword, message = m.groups()
-                    percent = int(percent)
-        self.most_recent_bootstrap_status = (percent, keyword, message)
+                    groups = m.groups()
+                elif self.most_recent_bootstrap_status is not None:
+                    return
+        if groups is None:
+            # This is our first scan, or the log has been truncated:
+            # search backwards from the end of the log
+            (groups, self._bootstrap_log_offset) = _searchLogBackwards(
+                logfname, _RE_BOOTSTRAP)
+        if groups:
+            percent, keyword, message = (_decodeLog(g) for g in groups)
+            self.most_recent_bootstrap_status = (int(percent), keyword,
+                                                 message)
+        else:
+            self.most_recent_bootstrap_status = (
+                LocalNodeController.NO_RECORDS_CODE,
+                "no_message",
+                "No bootstrap messages yet.")
 
     def getLastBootstrapStatus(self):
         """Return the last bootstrap message fetched by
@@ -1371,8 +2116,12 @@ class LocalNodeController(NodeController):
     def updateLastStatus(self):
         """Update last messages this node has received, for use with
            isBootstrapped and the getLast* functions.
+
+           Only onion services scan their info logs for onion service
+           descriptor messages.
         """
-        self.updateLastOnionServiceDescStatus()
+        if self.isOnionService():
+            self.updateLastOnionServiceDescStatus()
         self.updateLastBootstrapStatus()
 
     def isBootstrapped(self):
@@ -1425,10 +2174,22 @@ class LocalNodeController(NodeController):
              * "ns_cons", "desc", and "desc_new";
              * "md_cons", "md", and "md_new"; and
              * "br_status".
+
+           The paths never change, so the result is cached, and must not be
+           modified by the caller.
         """
+        v2_dir_paths = bool(v2_dir_paths)
+        result = self._cache_dir_info_paths.get(v2_dir_paths)
+        if result is None:
+            result = self._getNodeCacheDirInfoPaths(v2_dir_paths)
+            self._cache_dir_info_paths[v2_dir_paths] = result
+        return result
+
+    def _getNodeCacheDirInfoPaths(self, v2_dir_paths):
+        """Uncached implementation of getNodeCacheDirInfoPaths()."""
         to_bridge_client = self.getBridgeClient()
         to_bridge_auth = self.getBridgeAuthority()
-        datadir = self._env['dir']
+        datadir = self._datadir
         to_dir_server = self.getDirServer()
 
         desc = Path(datadir, "cached-descriptors")
@@ -1470,6 +2231,9 @@ class LocalNodeController(NodeController):
 
            See getNodeCacheDirInfoPaths() for the path data structure, and which
            nodes appear in each type of directory.
+
+           The dict is shared with other nodes in the same kind of directory,
+           and must not be modified by the caller.
         """
         consensus_member = self.getConsensusMember()
         bridge_member = self.getBridge()
@@ -1480,22 +2244,8 @@ class LocalNodeController(NodeController):
         if not consensus_member and not bridge_member:
             return None
 
-        launch_phase = _THE_NETWORK._dfltEnv['launch_phase']
-
         # at this point, consensus_member == not bridge_member
-        directory_files = dict()
-        for node in _THE_NETWORK._nodes:
-            if node._env['launch_phase'] > launch_phase:
-                continue
-            nick = node._env['nick']
-            controller = node.getController()
-            node_files = controller.getNodeCacheDirInfoPaths(consensus_member)
-            # skip empty file lists
-            if node_files:
-                directory_files[nick] = node_files
-
-        assert len(directory_files) > 0
-        return directory_files
+        return _THE_NETWORK.getPublishedDirInfoPaths(consensus_member)
 
     def getNodeDirInfoStatusPattern(self, dir_format):
         """Returns a regular expression pattern for finding this node's entry
@@ -1532,6 +2282,44 @@ class LocalNodeController(NodeController):
                 # If there is no ed25519_id, then we can't search for it
                 return None
 
+    def getNodeDirInfoStatusPrefix(self, dir_format):
+        """Returns the literal start of this node's entry lines in a
+           dir_format file, if getNodeDirInfoStatusPattern(dir_format) is
+           just a line prefix.  Otherwise, returns None.
+        """
+        if dir_format in ["ns_cons", "md_cons"]:
+            return "r " + self.getNick() + " "
+        elif dir_format in ["desc", "desc_new"]:
+            return "router " + self.getNick() + " "
+        else:
+            return None
+
+    def _getDirInfoStatusMatcher(self, dir_format):
+        """Return a function that takes the bytes of a dir_format file, and
+           returns a true value if this node is in the file.  Returns None
+           if getNodeDirInfoStatusPattern(dir_format) is not available.
+
+           Line prefixes are found with a plain substring search, which is
+           much faster than a regular expression.  Matchers are cached on
+           this controller.
+        """
+        matcher = self._dir_matchers.get(dir_format)
+        if matcher is None:
+            prefix = self.getNodeDirInfoStatusPrefix(dir_format)
+            if prefix is not None:
+                matcher = functools.partial(_hasLinePrefix,
+                                            prefix=prefix.encode('utf-8'))
+            else:
+                pattern = self.getNodeDirInfoStatusPattern(dir_format)
+                if pattern is None:
+                    # don't cache this: the pattern may be available later,
+                    # for example, after tor writes our ed25519 key
+                    return None
+                matcher = re.compile(pattern.encode('utf-8'),
+                                     re.MULTILINE).search
+            self._dir_matchers[dir_format] = matcher
+        return matcher
+
     def getFileDirInfoStatus(self, dir_format, dir_path):
         """Check dir_path, a directory path used by another node, to see if
            this node is present. The directory path is a dir_format file.
@@ -1543,45 +2331,65 @@ class LocalNodeController(NodeController):
                * SUCCESS_CODE means "in the directory";
              * a set containing dir_format; and
              * a status message string.
+
+           Directory files only change every few seconds, so we remember
+           the status for each file, and only search it again when the file
+           has been replaced or modified.
         """
-        dir_path = Path(dir_path)
-        if not dir_path.exists():
+        try:
+            st = os.stat(dir_path)
+        except FileNotFoundError:
             return (LocalNodeController.MISSING_FILE_CODE,
                     { dir_format }, "No dir file")
+        file_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cache_key = (dir_format, dir_path)
+        cached = self._dir_file_statuses.get(cache_key)
+        if cached is not None and cached[0] == file_id:
+            (_, status_code, status_msg) = cached
+            return (status_code, { dir_format }, status_msg)
+
+        (status_code, status_msg) = self._searchDirFile(dir_format, dir_path)
+        # if we don't have a pattern yet, the status can change without
+        # the file changing
+        if status_code != LocalNodeController.NOT_YET_IMPLEMENTED_CODE:
+            self._dir_file_statuses[cache_key] = (file_id,
+                                                  status_code,
+                                                  status_msg)
+        return (status_code, { dir_format }, status_msg)
+
+    def _searchDirFile(self, dir_format, dir_path):
+        """Search dir_path, a dir_format file, for this node, and return
+           a 2-tuple containing the status code and status message for
+           getFileDirInfoStatus().
+        """
+        dir_matcher = self._getDirInfoStatusMatcher(dir_format)
 
-        dir_pattern = self.getNodeDirInfoStatusPattern(dir_format)
-
-        line_count = 0
-        with dir_path.open(mode='r') as f:
-            for line in f:
-                line_count = line_count + 1
-                if dir_pattern:
-                    m = re.search(dir_pattern, line)
-                    if m:
-                        return (LocalNodeController.SUCCESS_CODE,
-                                { dir_format }, "Dir info cached")
+        # search the whole file at once, rather than line by line
+        with _mapped_file(dir_path) as data:
+            if dir_matcher and dir_matcher(data):
+                return (LocalNodeController.SUCCESS_CODE, "Dir info cached")
+            # we only need to know if the file is empty or short
+            line_count = _count_lines(data, 8)
 
         if line_count == 0:
-            return (LocalNodeController.NO_RECORDS_CODE,
-                    { dir_format }, "Empty dir file")
-        elif dir_pattern is None:
+            return (LocalNodeController.NO_RECORDS_CODE, "Empty dir file")
+        elif dir_matcher is None:
             return (LocalNodeController.NOT_YET_IMPLEMENTED_CODE,
-                    { dir_format }, "Not yet implemented")
+                    "Not yet implemented")
         elif line_count < 8:
             # The minimum size of the bridge networkstatus is 3 lines,
             # and the minimum size of one bridge is 5 lines
             # Let the user know the dir file is unexpectedly small
-            return (LocalNodeController.SHORT_FILE_CODE,
-                    { dir_format }, "Very short dir file")
+            return (LocalNodeController.SHORT_FILE_CODE, "Very short dir file")
         else:
-            return (LocalNodeController.NO_PROGRESS_CODE,
-                    { dir_format }, "Not in dir file")
+            return (LocalNodeController.NO_PROGRESS_CODE, "Not in dir file")
 
     def combineDirInfoStatuses(self, dir_status, status_key_list,
                                best=True, ignore_missing=False):
         """Combine the directory statuses in dir_status, if their keys
            appear in status_key_list. Keys may be directory formats, or
-           node nicks.
+           node nicks. status_key_list may be any collection of keys, such
+           as a list or a frozenset.
 
            If best is True, choose the best status, otherwise, choose the
            worst status.
@@ -1593,45 +2401,64 @@ class LocalNodeController(NodeController):
 
            Returns None if the status list is empty.
         """
-        dir_status_list = [ dir_status[status_key]
-                            for status_key in dir_status
-                            if status_key in status_key_list ]
-
-        if len(dir_status_list) == 0:
-            return None
-
-        dir_status = None
-        for new_status in dir_status_list:
-            if dir_status is None:
-                dir_status = new_status
+        # fold the statuses in a single pass.  Most calls only find one
+        # status, so we return it as-is, without ranking or copying it.
+        comb_status = None
+        comb_rank = None
+        # the combined format set, once we own a copy we can update in place
+        comb_flav = None
+        for status_key in status_key_list:
+            new_status = dir_status.get(status_key)
+            if new_status is None:
+                continue
+            if comb_status is None:
+                comb_status = new_status
                 continue
 
-            (old_status_code, old_flav, old_msg) = dir_status
-            (new_status_code, new_flav, new_msg) = new_status
-            if new_status_code == old_status_code:
+            comb_code = comb_status[0]
+            new_status_code = new_status[0]
+            if new_status_code == comb_code:
                 # We want to know all the flavours that have an
-                # equal status, not just the latest one
-                combined_flav = old_flav.union(new_flav)
-                dir_status = (old_status_code, combined_flav, old_msg)
-            elif (old_status_code == LocalNodeController.MISSING_FILE_CODE and
-                  ignore_missing):
-                # use the new status, which can't be MISSING_FILE_CODE,
-                # because they're not equal
-                dir_status = new_status
-            elif (new_status_code == LocalNodeController.MISSING_FILE_CODE and
-                  ignore_missing):
-                # ignore the new status
-                pass
-            elif old_status_code == LocalNodeController.NOT_YET_IMPLEMENTED_CODE:
-                # always ignore not yet implemented
-                dir_status = new_status
-            elif new_status_code == LocalNodeController.NOT_YET_IMPLEMENTED_CODE:
-                pass
-            elif best and new_status_code > old_status_code:
-                dir_status = new_status
-            elif not best and new_status_code < old_status_code:
-                dir_status = new_status
-        return dir_status
+                # equal status, not just the latest one.
+                # Copy the winner's set once, so we never modify the caller's
+                # statuses, then accumulate into our copy.
+                if comb_flav is None:
+                    comb_flav = set(comb_status[1])
+                comb_flav |= new_status[1]
+                continue
+
+            if comb_rank is None:
+                comb_rank = LocalNodeController._dirStatusRank(
+                    comb_code, best, ignore_missing)
+            new_rank = LocalNodeController._dirStatusRank(
+                new_status_code, best, ignore_missing)
+            if new_rank > comb_rank:
+                comb_status = new_status
+                comb_rank = new_rank
+                comb_flav = None
+
+        if comb_flav is not None:
+            return (comb_status[0], comb_flav, comb_status[2])
+        return comb_status
+
+    @staticmethod
+    def _dirStatusRank(status_code, best, ignore_missing):
+        """Return a sort key for status_code, for combineDirInfoStatuses().
+           The status with the highest key wins.
+
+           Missing files (if ignore_missing is True) lose to every other
+           status, then not yet implemented statuses lose to everything
+           else.  Otherwise, the best (or worst) status code wins.
+        """
+        if (status_code == LocalNodeController.MISSING_FILE_CODE and
+                ignore_missing):
+            return (0, 0)
+        elif status_code == LocalNodeController.NOT_YET_IMPLEMENTED_CODE:
+            return (1, 0)
+        elif best:
+            return (2, status_code)
+        else:
+            return (2, -status_code)
 
     def summariseCacheDirInfoStatus(self,
                                     dir_status,
@@ -1661,21 +2488,20 @@ class LocalNodeController(NodeController):
         """
         from_bridge = self.getBridge()
         # Is this node a bridge, publishing to a bridge client?
-        bridge_to_bridge_client = self.getBridge() and to_bridge_client
+        bridge_to_bridge_client = from_bridge and to_bridge_client
         # Is this node a consensus relay, publishing to a bridge client?
         relay_to_bridge_client = self.getConsensusRelay() and to_bridge_client
 
         # We only need to be in one of these files to be successful
         desc_alts = self.combineDirInfoStatuses(dir_status,
-                                                ["desc", "desc_new"],
+                                                _DESC_ALTS_KEYS,
                                                 best=True,
                                                 ignore_missing=True)
         if desc_alts:
             dir_status["desc_alts"] = desc_alts
 
         md_alts = self.combineDirInfoStatuses(dir_status,
-                                              ["md",
-                                               "md_new"],
+                                              _MD_ALTS_KEYS,
                                               best=True,
                                               ignore_missing=True)
         if md_alts:
@@ -1690,16 +2516,14 @@ class LocalNodeController(NodeController):
             # combined flavour status, and we want to treat missing files as
             # errors
             cons_all = self.combineDirInfoStatuses(dir_status,
-                                                   ["ns_cons",
-                                                    "md_cons"],
+                                                   _CONS_KEYS,
                                                    best=False,
                                                    ignore_missing=False)
         else:
             # Clients usually only fetch one flavour, so we want the best
             # combined flavour status, and we want to ignore missing files
             cons_all = self.combineDirInfoStatuses(dir_status,
-                                                   ["ns_cons",
-                                                    "md_cons"],
+                                                   _CONS_KEYS,
                                                    best=True,
                                                    ignore_missing=True)
         if cons_all:
@@ -1723,14 +2547,12 @@ class LocalNodeController(NodeController):
                 desc_all = dir_status["md_alts"]
         elif to_dir_server:
             desc_all = self.combineDirInfoStatuses(dir_status,
-                                                   ["desc_alts",
-                                                    "md_alts"],
+                                                   _DESC_ALL_KEYS,
                                                    best=False,
                                                    ignore_missing=False)
         else:
             desc_all = self.combineDirInfoStatuses(dir_status,
-                                                   ["desc_alts",
-                                                    "md_alts"],
+                                                   _DESC_ALL_KEYS,
                                                    best=True,
                                                    ignore_missing=True)
         if desc_all:
@@ -1739,9 +2561,7 @@ class LocalNodeController(NodeController):
         # Finally, get the worst status from all the combined statuses,
         # and the bridge status (if applicable)
         node_dir = self.combineDirInfoStatuses(dir_status,
-                                               ["cons_all",
-                                                "br_status",
-                                                "desc_all"],
+                                               _NODE_DIR_KEYS,
                                                best=False,
                                                ignore_missing=True)
         if node_dir:
@@ -1769,14 +2589,13 @@ class LocalNodeController(NodeController):
 
         # we don't expect the other node to have us in its files
         if other_node_files:
-            for dir_format in other_node_files:
-                dir_path = other_node_files[dir_format]
+            for dir_format, dir_path in other_node_files.items():
                 new_status = self.getFileDirInfoStatus(dir_format, dir_path)
                 if new_status is None:
                     continue
                 dir_status[dir_format] = new_status
 
-        if len(dir_status):
+        if dir_status:
             return self.summariseCacheDirInfoStatus(dir_status,
                                                     to_dir_server,
                                                     to_bridge_client)
@@ -1815,11 +2634,11 @@ class LocalNodeController(NodeController):
 
         dir_statuses = dict()
         # For all the nodes we expect will have us in their directory
-        for other_node_nick in dir_files:
+        for other_node_nick, other_node_paths in dir_files.items():
             (to_dir_server,
              to_bridge_client,
-             other_node_files) = dir_files[other_node_nick]
-            if not other_node_files or not len(other_node_files):
+             other_node_files) = other_node_paths
+            if not other_node_files:
                 # we don't expect this node to have us in its files
                 pass
             dir_statuses[other_node_nick] = \
@@ -1827,7 +2646,7 @@ class LocalNodeController(NodeController):
                                                to_dir_server,
                                                to_bridge_client)
 
-        if len(dir_statuses):
+        if dir_statuses:
             return dir_statuses
         else:
             # this node must be a client
@@ -1864,35 +2683,27 @@ class LocalNodeController(NodeController):
 
         # check if we expect this node to be published to other nodes
         if dir_status:
-            status_code_set = { dir_status[other_node_nick][0]
-                                for other_node_nick in dir_status
-                                if dir_status[other_node_nick] is not None }
-
-            for status_code in status_code_set:
-                other_node_nick_list = [
-                    other_node_nick
-                    for other_node_nick in dir_status
-                    if dir_status[other_node_nick] is not None and
-                       dir_status[other_node_nick][0] == status_code ]
-
-                comb_status = self.combineDirInfoStatuses(
-                    dir_status,
-                    other_node_nick_list,
-                    best=False)
-
-                if comb_status is not None:
-                    (comb_code, comb_format_set, comb_msg) = comb_status
-                    assert comb_code == status_code
-
+            # group the other nodes by status code, and combine their
+            # statuses, in a single pass.  All the statuses in a group have
+            # the same code, so combining them just merges their formats.
+            for other_node_nick, other_status in dir_status.items():
+                if other_status is None:
+                    continue
+                (status_code, format_set, status_msg) = other_status
+                comb_status = node_status.get(status_code)
+                if comb_status is None:
                     node_status[status_code] = (status_code,
-                                                other_node_nick_list,
-                                                comb_format_set,
-                                                comb_msg)
+                                                [other_node_nick],
+                                                set(format_set),
+                                                status_msg)
+                else:
+                    comb_status[1].append(other_node_nick)
+                    comb_status[2].update(format_set)
 
         node_all = None
-        if len(node_status):
+        if node_status:
             # Finally, get the worst status from all the other nodes
-            worst_status_code = min(status_code_set)
+            worst_status_code = min(node_status)
             node_all = node_status[worst_status_code]
         else:
             # this node should be a client
@@ -1902,14 +2713,14 @@ class LocalNodeController(NodeController):
             consensus_member = self.getConsensusMember()
             bridge_member = self.getBridge()
             if consensus_member or bridge_member:
+                cons = "consensus" if consensus_member else ""
+                sep = " and " if consensus_member and bridge_member else ""
+                bridge = "bridge" if bridge_member else ""
                 node_all = (LocalNodeController.INTERNAL_ERROR_CODE,
                             set(),
                             set(),
-                            "Expected {}{}{} dir info, but status is empty."
-                            .format("consensus" if consensus_member else "",
-                                    " and " if consensus_member
-                                            and bridge_member else "",
-                                    "bridge" if bridge_member else ""))
+                            f"Expected {cons}{sep}{bridge} dir info, "
+                            "but status is empty.")
             else:
                 # clients don't publish dir info
                 node_all = None
@@ -1991,6 +2802,9 @@ DEFAULTS = {
     'tor-gencert': os.environ.get('CHUTNEY_TOR_GENCERT', None),
     # auth_cert_lifetime: lifetime of authority certs, in months
     'auth_cert_lifetime': 12,
+    # force_keygen: run tor to list each relay's fingerprint, even if its
+    # identity key and fingerprint file already exist
+    'force_keygen': getenv_bool('CHUTNEY_FORCE_KEYGEN', False),
     # ip: primary IP address (usually IPv4) to listen on
     'ip': os.environ.get('CHUTNEY_LISTEN_ADDRESS', '127.0.0.1'),
     # ipv6_addr: secondary IP address (usually IPv6) to listen on. we default to
@@ -2043,10 +2857,16 @@ DEFAULTS = {
     # controlling_pid: the PID of the controlling script
     # (for __OwningControllerProcess)
     'controlling_pid': getenv_int('CHUTNEY_CONTROLLING_PID', 0),
+    # config_jobs: the number of nodes to generate keys for at the same
+    # time during configure.  0 (the default) means twice the CPU count,
+    # and 1 generates keys one node at a time.
+    'config_jobs': getenv_int('CHUTNEY_CONFIG_JOBS', 0),
+    # status_jobs: the number of node logs to scan at the same time while
+    # waiting for bootstrap.  0 (the default) means four times the CPU
+    # count (up to 32), and 1 scans the logs one node at a time.
+    'status_jobs': getenv_int('CHUTNEY_STATUS_JOBS', 0),
     # dns_conf: a DNS config file (for ServerDNSResolvConfFile)
-    'dns_conf': (os.environ.get('CHUTNEY_DNS_CONF', '/etc/resolv.conf')
-                        if 'CHUTNEY_DNS_CONF' in os.environ
-                        else None),
+    'dns_conf': os.environ.get('CHUTNEY_DNS_CONF', None),
 
     # config_phase, launch_phase: The phase at which this instance needs to be
     # configured/launched, if we're doing multiphase configuration/launch.
@@ -2060,7 +2880,7 @@ DEFAULTS = {
     # sandbox: the Sandbox torrc option value
     # defaults to 1 on Linux, and 0 otherwise
     'sandbox': int(getenv_bool('CHUTNEY_TOR_SANDBOX',
-                               platform.system() == 'Linux')),
+                               sys.platform.startswith('linux'))),
 }
 
 
@@ -2136,12 +2956,11 @@ class TorEnviron(chutney.Templating.Environ):
         return my['ptport_base'] + my['nodenum']
 
     def _get_dir(self, my):
-        return Path(my['net_base_dir'],
-                    "nodes",
-                    "%03d%s" % (my['nodenum'], my['tag'])).resolve()
+        return Path(get_resolved_nodes_dir(my['net_base_dir']),
+                    f"{my['nodenum']:03d}{my['tag']}")
 
     def _get_nick(self, my):
-        return "test%03d%s" % (my['nodenum'], my['tag'])
+        return f"test{my['nodenum']:03d}{my['tag']}"
 
     def _get_tor_gencert(self, my):
         return my['tor-gencert'] or '{0}-gencert'.format(my['tor'])
@@ -2209,6 +3028,18 @@ class TorEnviron(chutney.Templating.Environ):
             dns_conf = TorEnviron.DEFAULT_DNS_RESOLV_CONF
         else:
             dns_conf = my['dns_conf']
+        return "ServerDNSResolvConfFile %s" % (
+            TorEnviron._resolveDnsConf(dns_conf))
+
+    @staticmethod
+    @chutney.Util.memoized
+    def _resolveDnsConf(dns_conf):
+        """Return the resolved path to the DNS conf file dns_conf, or
+           OFFLINE_DNS_RESOLV_CONF if it does not exist.
+
+           The file doesn't change during a chutney run, so we only check
+           it (and warn about it) once, rather than once per node.
+        """
         dns_conf = Path(dns_conf).resolve()
         # work around Tor bug #21900, where exits fail when the DNS conf
         # file does not exist, or is a broken symlink
@@ -2218,7 +3049,7 @@ class TorEnviron(chutney.Templating.Environ):
             print("CHUTNEY_DNS_CONF '{}' does not exist, using '{}'."
                   .format(dns_conf, TorEnviron.OFFLINE_DNS_RESOLV_CONF))
             dns_conf = TorEnviron.OFFLINE_DNS_RESOLV_CONF
-        return "ServerDNSResolvConfFile %s" % (dns_conf)
+        return dns_conf
 
 KNOWN_REQUIREMENTS = {
     "IPV6": chutney.Host.is_ipv6_supported
@@ -2233,18 +3064,67 @@ class Network(object):
         self._requirements = []
         self._dfltEnv = defaultEnviron
         self._nextnodenum = 0
+        self._pending_writes = []
+        # The thread pool used by pollStatuses(), created on first use,
+        # and shut down when wait_for_bootstrap() returns
+        self._status_pool = None
+        # A map from (launch phase, consensus member) to the result of
+        # getPublishedDirInfoPaths()
+        self._published_dir_info_paths = {}
+        # The controllers for our nodes, or None if we haven't listed them
+        # since the last node was added
+        self._controllers = None
+        # A (controllers, nick controller pairs, nick frozenset,
+        # consensus authority nick frozenset, cache and client nick
+        # frozenset) tuple for the controllers list passed to the last
+        # print_bootstrap_status() call, or None if it hasn't been called
+        self._status_nick_sets = None
         self.dir = ""
 
     def _addNode(self, n):
         n.setNodenum(self._nextnodenum)
         self._nextnodenum += 1
         self._nodes.append(n)
+        self._controllers = None
+
+    def _getControllers(self):
+        """Return a list of the controllers for all our nodes, in node
+           order.  The list is shared, so callers must not modify it.
+        """
+        if self._controllers is None:
+            self._controllers = [n.getController() for n in self._nodes]
+        return self._controllers
+
+    def _addPendingWrite(self, tmp_path, path):
+        """Remember to move the file tmp_path to path when
+           _finishPendingWrites() is called.
+        """
+        self._pending_writes.append((tmp_path, path))
+
+    def _finishPendingWrites(self):
+        """Move all the files passed to _addPendingWrite() into place."""
+        for (tmp_path, path) in self._pending_writes:
+            os.replace(tmp_path, path)
+        self._pending_writes = []
+
+    def _discardPendingWrites(self):
+        """Remove any files passed to _addPendingWrite() that haven't been
+           moved into place.
+        """
+        for (tmp_path, _) in self._pending_writes:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        self._pending_writes = []
 
     def _addRequirement(self, requirement):
         requirement = requirement.upper()
         if requirement not in KNOWN_REQUIREMENTS:
             raise RuntimeError(("Unrecognized requirement %r"%requirement))
-        self._requirements.append(requirement)
+        # supported() checks each requirement once
+        if requirement not in self._requirements:
+            self._requirements.append(requirement)
 
     def move_aside_nodes_dir(self):
         """Move aside the nodes directory, if it exists and is not a link.
@@ -2261,6 +3141,7 @@ class Network(object):
             return
 
         # subtract 1 second to avoid collisions and get the correct ordering
+        # newdir is created empty, and the rename replaces it
         newdir = get_new_absolute_nodes_path(time.time() - 1)
 
         print("NOTE: renaming '%s' to '%s'" % (nodesdir, newdir))
@@ -2273,53 +3154,80 @@ class Network(object):
         # (if it's not a link)
         self.move_aside_nodes_dir()
 
-        # the unique directory we'll create
-        newnodesdir = get_new_absolute_nodes_path()
         # the canonical name we'll link it to
         nodeslink = get_absolute_nodes_path()
 
-        # this path should be unique and should not exist
-        if newnodesdir.exists():
-            raise RuntimeError(
-                'get_new_absolute_nodes_path returned a path that exists')
-
         # if this path exists, it must be a link
-        if nodeslink.exists() and not nodeslink.is_symlink():
+        # (one lstat() tells us whether it exists, and whether it's a link)
+        try:
+            nodeslink_is_link = stat.S_ISLNK(nodeslink.lstat().st_mode)
+        except FileNotFoundError:
+            nodeslink_is_link = None
+        if nodeslink_is_link is False:
             raise RuntimeError(
                 'get_absolute_nodes_path returned a path that exists and '
                 'is not a link')
 
         # create the new, uniquely named directory, and link it to nodes
-        print("NOTE: creating '%s', linking to '%s'" % (newnodesdir, nodeslink))
         # this gets created with mode 0700, that's probably ok
-        mkdir_p(newnodesdir)
-        try:
+        newnodesdir = get_new_absolute_nodes_path()
+        print("NOTE: creating '%s', linking to '%s'" % (newnodesdir, nodeslink))
+        # it's ok if the link doesn't exist, we're just about to make it
+        if nodeslink_is_link:
             nodeslink.unlink()
-        except OSError as e:
-            # it's ok if the link doesn't exist, we're just about to make it
-            if e.errno == errno.ENOENT:
-                pass
-            else:
-                raise
         nodeslink.symlink_to(newnodesdir)
+        _RESOLVED_NODES_DIRS.clear()
         self.dir = newnodesdir
 
-    def _checkConfig(self):
-        for n in self._nodes:
-            n.getBuilder().checkConfig(self)
+    def _checkConfig(self, builders):
+        for b in builders:
+            b.checkConfig(self)
+
+    def _prefetchTorInfo(self):
+        """Probe all the tor and tor-gencert binaries used by our nodes in
+           parallel, so that per-node checks hit the probe caches.
+        """
+        prefetch_tor_info([n._env['tor'] for n in self._nodes],
+                          [n._env['tor_gencert'] for n in self._nodes
+                           if n._env['authority']])
+
+    def _preConfigBuilders(self, builders):
+        """Call preConfig on each builder in builders.
+
+           Key generation happens in tor and tor-gencert subprocesses, and
+           each builder only touches its own data directory, so we run the
+           builders in a thread pool to overlap the subprocesses.  Set
+           CHUTNEY_CONFIG_JOBS to limit the number of threads.
+        """
+        if not builders:
+            return
+        max_workers = self._dfltEnv['config_jobs']
+        if max_workers <= 0:
+            max_workers = (os.cpu_count() or 1) * 2
+        if max_workers == 1:
+            for b in builders:
+                b.preConfig(self)
+            return
+        max_workers = min(len(builders), max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(b.preConfig, self) for b in builders]
+            # re-raise any exceptions (including SystemExit) in order
+            for f in futures:
+                f.result()
 
     def supported(self):
         """Check whether this network is supported by the set of binaries
            and host information we have.
         """
+        self._prefetchTorInfo()
         missing_any = False
         for r in self._requirements:
             if not KNOWN_REQUIREMENTS[r]():
-                print(("Can't run this network: %s is missing."))
+                print(("Can't run this network: %s is missing." % r))
                 missing_any = True
         for n in self._nodes:
             if not n.getBuilder().isSupported(self):
-                missing_any = False
+                missing_any = True
 
         if missing_any:
             sys.exit(1)
@@ -2331,6 +3239,7 @@ class Network(object):
         phase = self._dfltEnv['CUR_CONFIG_PHASE']
         if phase == 1:
             self.create_new_nodes_dir()
+        self._prefetchTorInfo()
         network = self
         altauthlines = []
         bridgelines = []
@@ -2339,13 +3248,16 @@ class Network(object):
         all_builders = [ n.getBuilder() for n in self._nodes ]
         builders = [ b for b in all_builders
                      if b._env['config_phase'] == phase ]
-        self._checkConfig()
+        # Check every torrc template before any key generation, so that
+        # template errors fail fast
+        self._checkConfig(all_builders)
 
         # XXX don't change node names or types or count if anything is
         # XXX running!
 
+        self._preConfigBuilders(all_builders)
+
         for b in all_builders:
-            b.preConfig(network)
             tor_auth_line, (arti_fallback, arti_auth) = b._getAltAuthLines(
                 self._dfltEnv['hasbridgeauth'])
             altauthlines.append(tor_auth_line)
@@ -2356,8 +3268,17 @@ class Network(object):
         self._dfltEnv['authorities'] = "".join(altauthlines)
         self._dfltEnv['bridges'] = "".join(bridgelines)
 
-        for b in builders:
-            b.config(network)
+        # Unlike preConfig(), config() doesn't wait on subprocesses: it
+        # renders each torrc in python, which holds the GIL.  It also shares
+        # the unsupported option warning count.  So it doesn't use the
+        # config thread pool.
+        try:
+            for b in builders:
+                b.config(network)
+            self._finishPendingWrites()
+        finally:
+            # if anything failed, don't leave torrc.tmp files behind
+            self._discardPendingWrites()
 
         with open(os.path.join(get_absolute_nodes_path(),"arti.toml"), 'w') as f:
             f.write("""[storage]
@@ -2379,10 +3300,11 @@ allow_local_addrs = true
             f.write("""[tor_network]
 fallback_caches = [
 """)
-            f.write("".join(arti_fallback_lines))
+            # the file is buffered, so we don't need to join the lines first
+            f.writelines(arti_fallback_lines)
             f.write("]\n")
             f.write("authorities = [\n")
-            f.write("".join(arti_auth_lines))
+            f.writelines(arti_auth_lines)
             f.write("]")
 
         for b in builders:
@@ -2393,9 +3315,12 @@ fallback_caches = [
            return True if all nodes are running.
         """
         cur_launch = self._dfltEnv['CUR_LAUNCH_PHASE']
-        statuses = [n.getController().check(listNonRunning=True)
-                    for n in self._nodes
-                    if n._env['launch_phase'] == cur_launch]
+        controllers = [c for c in self._getControllers()
+                       if c._env['launch_phase'] == cur_launch]
+        # check() prints the version of each node's tor, so probe mixed
+        # tor binaries in parallel first
+        prefetch_tor_versions([c._env['tor'] for c in controllers])
+        statuses = [c.check(listNonRunning=True) for c in controllers]
         n_ok = len([x for x in statuses if x])
         print("%d/%d nodes are running" % (n_ok, len(self._nodes)))
         return n_ok == len(statuses)
@@ -2412,8 +3337,8 @@ fallback_caches = [
         # format polling correctly - avoid printing a newline
         sys.stdout.write("Starting nodes")
         sys.stdout.flush()
-        rv = all([n.getController().start() for n in self._nodes
-                  if n._env['launch_phase'] ==
+        rv = all([c.start() for c in self._getControllers()
+                  if c._env['launch_phase'] ==
                   self._dfltEnv['CUR_LAUNCH_PHASE']])
         # now print a newline unconditionally - this stops poll()ing
         # output from being squashed together, at the cost of a blank
@@ -2426,44 +3351,40 @@ fallback_caches = [
            errors.
         """
         print("Sending SIGHUP to nodes")
-        return all([n.getController().hup() for n in self._nodes])
+        return all([c.hup() for c in self._getControllers()])
 
     def print_bootstrap_status(self,
                                controllers,
                                most_recent_desc_status,
                                elapsed=None,
                                msg="Bootstrap in progress"):
-        nick_set = set()
-        cons_auth_nick_set = set()
         elapsed_msg = ""
         if elapsed:
             elapsed_msg = ": {} seconds".format(int(elapsed))
         if msg:
             header = "{}{}".format(msg, elapsed_msg)
-        print(header)
-        print("Node status:")
-        for c in controllers:
-            c.check(listRunning=False, listNonRunning=True)
-            nick = c.getNick()
-            nick_set.add(nick)
-            if c.getConsensusAuthority():
-                cons_auth_nick_set.add(nick)
+        # collect the whole status, and write it all at once
+        out = [header, "Node status:"]
+        (nick_controllers,
+         nick_set,
+         cons_auth_nick_set,
+         cache_client_nick_set) = self._getStatusNickSets(controllers)
+        for (nick, c) in nick_controllers:
+            (_, check_msg) = c.getCheckStatus(listRunning=False,
+                                              listNonRunning=True)
+            if check_msg:
+                out.append(check_msg)
             pct, kwd, bmsg = c.getLastBootstrapStatus()
             # Support older tor versions without bootstrap keywords
             if not kwd:
                 kwd = "None"
-            print("{:13}: {:4}, {:25}, {}".format(nick,
-                                                  pct,
-                                                  kwd,
-                                                  bmsg))
-        cache_client_nick_set = nick_set.difference(cons_auth_nick_set)
-        print("Published dir info:")
-        for c in controllers:
-            nick = c.getNick()
+            out.append(f"{nick:13}: {pct:4}, {kwd:25}, {bmsg}")
+        out.append("Published dir info:")
+        for (nick, c) in nick_controllers:
             if nick in most_recent_desc_status:
                 desc_status = most_recent_desc_status[nick]
                 code, nodes, docs, dmsg = desc_status
-                node_set = set(nodes)
+                node_set = frozenset(nodes)
                 if node_set == nick_set:
                     nodes = "all nodes"
                 elif node_set == cons_auth_nick_set:
@@ -2485,29 +3406,139 @@ fallback_caches = [
                         docs.discard("md_new")
                         docs.add("md")
                     docs = " ".join(sorted(docs))
-                print("{:13}: {:4}, {:25}, {:30}, {}".format(nick,
-                                                             code,
-                                                             nodes,
-                                                             docs,
-                                                             dmsg))
-        print()
+                out.append(f"{nick:13}: {code:4}, {nodes:25}, {docs:30}, "
+                           f"{dmsg}")
+        # end with a blank line
+        out.append("\n")
+        sys.stdout.write("\n".join(out))
+        sys.stdout.flush()
+
+    def _getStatusNickSets(self, controllers):
+        """Return a (nick controller pairs, nick frozenset, consensus
+           authority nick frozenset, cache and client nick frozenset) tuple
+           for controllers, for print_bootstrap_status().
+
+           wait_for_bootstrap() passes the same controllers list to every
+           print_bootstrap_status() call, so we keep the result for the last
+           list.  Callers must not modify the list between calls.
+        """
+        cached = self._status_nick_sets
+        if cached is not None and cached[0] is controllers:
+            return cached[1:]
+        # look up each nick once, for all the status lines
+        nick_controllers = [(c.getNick(), c) for c in controllers]
+        nick_set = frozenset(nick for (nick, _) in nick_controllers)
+        cons_auth_nick_set = frozenset(nick
+                                       for (nick, c) in nick_controllers
+                                       if c.getConsensusAuthority())
+        cache_client_nick_set = nick_set.difference(cons_auth_nick_set)
+        self._status_nick_sets = (controllers,
+                                  nick_controllers,
+                                  nick_set,
+                                  cons_auth_nick_set,
+                                  cache_client_nick_set)
+        return self._status_nick_sets[1:]
 
     CHECK_NETWORK_STATUS_DELAY = 1.0
     PRINT_NETWORK_STATUS_DELAY = V3_AUTH_VOTING_INTERVAL/2.0
     CHECKS_PER_PRINT = PRINT_NETWORK_STATUS_DELAY / CHECK_NETWORK_STATUS_DELAY
 
+    def getPublishedDirInfoPaths(self, consensus_member):
+        """Return a dict of paths to the directory files of every node
+           that has been launched, keyed by nick.  If consensus_member is
+           True, return the consensus paths, otherwise return the bridge
+           paths.  See LocalNodeController.getNodeCacheDirInfoPaths() for
+           the path data structure.
+
+           Every consensus member (or bridge) expects to be published in
+           the same files, so we build this map once for each launch phase,
+           and share it between all the nodes.  The caller must not modify
+           it.
+        """
+        launch_phase = self._dfltEnv['launch_phase']
+        key = (launch_phase, bool(consensus_member))
+        directory_files = self._published_dir_info_paths.get(key)
+        if directory_files is None:
+            directory_files = dict()
+            for node in self._nodes:
+                if node._env['launch_phase'] > launch_phase:
+                    continue
+                nick = node._env['nick']
+                controller = node.getController()
+                node_files = controller.getNodeCacheDirInfoPaths(
+                    consensus_member)
+                # skip empty file lists
+                if node_files:
+                    directory_files[nick] = node_files
+
+            assert directory_files
+            self._published_dir_info_paths[key] = directory_files
+        return directory_files
+
+    @staticmethod
+    def _pollStatus(controller):
+        """Update controller's last status, and return a
+           (nick, bootstrapped, dir info status) tuple for it.
+           See pollStatuses() for details.
+        """
+        controller.updateLastStatus()
+        return (controller.getNick(),
+                controller.isBootstrapped(),
+                controller.getNodeDirInfoStatus())
+
+    def pollStatuses(self, controllers):
+        """Scan the logs of every controller in controllers, update their
+           last status messages, and check whether their descriptors are in
+           the directory files across the network.
+
+           Returns a list containing a (nick, bootstrapped, dir info status)
+           tuple for each controller, in the same order as controllers.
+           See getNodeDirInfoStatus() for the dir info status format.
+
+           Each log scan only reads the log lines written since the previous
+           scan, and unchanged directory files aren't searched again, so
+           this is cheap to call on every poll.  The checks are I/O bound,
+           so we run them in a thread pool, which is kept for later polls
+           until wait_for_bootstrap() returns.
+           Set CHUTNEY_STATUS_JOBS to limit the number of threads.
+        """
+        if self._status_pool is None:
+            max_workers = self._dfltEnv['status_jobs']
+            if max_workers <= 0:
+                max_workers = min(32, (os.cpu_count() or 1) * 4)
+            if max_workers == 1 or len(controllers) <= 1:
+                return [Network._pollStatus(c) for c in controllers]
+            max_workers = min(len(controllers), max_workers)
+            self._status_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers)
+        # each controller only updates its own status and caches, so the
+        # checks don't interfere.  Re-raise any exceptions in order.
+        return list(self._status_pool.map(Network._pollStatus, controllers))
+
     def wait_for_bootstrap(self):
         """Invoked from tools/test-network.sh to wait for the network to
            bootstrap.
         """
+        try:
+            return self._waitForBootstrap()
+        finally:
+            # don't keep the status threads around after the wait
+            if self._status_pool is not None:
+                self._status_pool.shutdown()
+                self._status_pool = None
+
+    def _waitForBootstrap(self):
+        """Wait for the network to bootstrap, and return True if it did.
+           Helper for wait_for_bootstrap().
+        """
         print("Waiting for nodes to bootstrap...\n")
         start = time.time()
         limit = start + getenv_int("CHUTNEY_START_TIME", 60)
         next_print_status = start + Network.PRINT_NETWORK_STATUS_DELAY
         bootstrap_upto = self._dfltEnv['CUR_LAUNCH_PHASE']
 
-        controllers = [n.getController() for n in self._nodes
-                       if n._env['launch_phase'] <= bootstrap_upto ]
+        controllers = [c for c in self._getControllers()
+                       if c._env['launch_phase'] <= bootstrap_upto ]
         min_time_list = [c.getMinStartTime() for c in controllers]
         min_time = max(min_time_list)
         wait_time_list = [c.getUncheckedDirInfoWaitTime() for c in controllers]
@@ -2515,17 +3546,25 @@ fallback_caches = [
 
         checks_since_last_print = 0
 
+        # wake up if any tor exits, because the network can't bootstrap
+        # without it
+        (poller, pidfds) = Network._pollPidfds(controllers)
+        pidfd_nicks = dict()
+        if pidfds:
+            for c in controllers:
+                pidfd = c.getPidfd()
+                if pidfd in pidfds:
+                    pidfd_nicks[pidfd] = c.getNick()
+
         while True:
             all_bootstrapped = True
             most_recent_desc_status = dict()
-            for c in controllers:
-                nick = c.getNick()
-                c.updateLastStatus()
-
-                if not c.isBootstrapped():
+            for (nick,
+                 bootstrapped,
+                 desc_status) in self.pollStatuses(controllers):
+                if not bootstrapped:
                     all_bootstrapped = False
 
-                desc_status = c.getNodeDirInfoStatus()
                 if desc_status:
                     code, nodes, docs, dmsg = desc_status
                     most_recent_desc_status[nick] = (code,
@@ -2550,7 +3589,9 @@ fallback_caches = [
                 # Also used to work around a timing bug in Tor 0.3.5.
                 print("Waiting {} seconds for the network to be ready...\n"
                       .format(int(wait_time)))
-                time.sleep(wait_time)
+                # count the time we spent printing the status as part of
+                # the wait
+                time.sleep(max(0, now + wait_time - time.time()))
                 now = time.time()
                 elapsed = now - start
 
@@ -2598,7 +3639,19 @@ fallback_caches = [
                                          Network.PRINT_NETWORK_STATUS_DELAY)
                     checks_since_last_print = 0
 
-            time.sleep(Network.CHECK_NETWORK_STATUS_DELAY)
+            if poller is None:
+                time.sleep(Network.CHECK_NETWORK_STATUS_DELAY)
+            else:
+                exited = poller.poll(Network.CHECK_NETWORK_STATUS_DELAY * 1000)
+                if exited:
+                    self.print_bootstrap_status(controllers,
+                                                most_recent_desc_status,
+                                                elapsed=elapsed,
+                                                msg="Bootstrap failed")
+                    print("Nodes exited before bootstrapping: {}"
+                          .format(" ".join(sorted(pidfd_nicks[fd]
+                                                  for (fd, _) in exited))))
+                    return False
 
             # macOS Travis has some weird hangs, make sure we're not hanging
             # in this loop due to clock skew
@@ -2652,36 +3705,47 @@ fallback_caches = [
         # check for stale lock files when Tor crashes
         # move aside old pid files after Tor stops running
         if cleanup_runfiles:
-            controllers = [n.getController() for n in self._nodes]
+            controllers = self._getControllers()
             for c in controllers:
-                c.cleanup_lockfile()
-                c.cleanup_pidfile()
+                pid = c.getPid()
+                c.cleanup_lockfile(pid)
+                c.cleanup_pidfile(pid)
 
     def stop(self):
         """Stop our network's running tor nodes."""
         any_tor_was_running = False
-        controllers = [n.getController() for n in self._nodes]
+        # the nodes that were still running at the last check, so we don't
+        # signal or check nodes that have already exited
+        alive = self._getControllers()
         for sig, desc in [(signal.SIGINT, "SIGINT"),
                           (signal.SIGINT, "another SIGINT"),
                           (signal.SIGKILL, "SIGKILL")]:
             print("Sending %s to nodes" % desc)
-            for c in controllers:
-                if c.isRunning():
+            for c in alive:
+                if c.sendSignal(sig):
                     any_tor_was_running = True
-                    c.stop(sig=sig)
             print("Waiting for nodes to finish.")
             wrote_dot = False
+            # wake up as soon as all the nodes have exited, rather than
+            # checking them once a second
+            (poller, pidfds) = Network._pollPidfds(alive)
+            deadline = time.monotonic()
             for _ in range(15):
-                time.sleep(1)
-                if all(not c.isRunning() for c in controllers):
-                    self.final_cleanup(wrote_dot,
-                                       any_tor_was_running,
-                                       True)
-                    return
+                deadline += 1
+                while True:
+                    wait_for_pidfds(poller, pidfds, deadline)
+                    alive = [c for c in alive if c.isRunning()]
+                    if not alive:
+                        self.final_cleanup(wrote_dot,
+                                           any_tor_was_running,
+                                           True)
+                        return
+                    if time.monotonic() >= deadline:
+                        break
                 sys.stdout.write(".")
                 wrote_dot = True
                 sys.stdout.flush()
-            for c in controllers:
+            for c in alive:
                 c.check(listNonRunning=False)
             # cleanup chutney's logging, but don't wait or cleanup files
             self.final_cleanup(wrote_dot,
@@ -2692,13 +3756,34 @@ fallback_caches = [
                            any_tor_was_running,
                            True)
 
+    @staticmethod
+    def _pollPidfds(controllers):
+        """Return a (poller, pidfds) tuple for wait_for_pidfds(), which waits
+           for all the running controllers in controllers to exit.
+
+           If we can't open a pidfd for any running controller, return
+           (None, None), so wait_for_pidfds() falls back to sleeping.
+        """
+        poller = select.poll()
+        pidfds = set()
+        for c in controllers:
+            if not c.isRunning():
+                continue
+            pidfd = c.getPidfd()
+            if pidfd is None:
+                return (None, None)
+            poller.register(pidfd, select.POLLIN)
+            pidfds.add(pidfd)
+        return (poller, pidfds)
+
     def print_phases(self):
         """Print the total number of phases in which the network is
            initialized, configured, or bootstrapped."""
-        def max_phase(key):
-            return max(int(n._env[key]) for n in self._nodes)
-        cfg_max = max_phase("config_phase")
-        launch_max = max_phase("launch_phase")
+        # find both maximums in a single pass over the nodes
+        cfg_max = launch_max = 0
+        for n in self._nodes:
+            cfg_max = max(cfg_max, int(n._env["config_phase"]))
+            launch_max = max(launch_max, int(n._env["launch_phase"]))
         print("CHUTNEY_CONFIG_PHASES={}".format(cfg_max))
         print("CHUTNEY_LAUNCH_PHASES={}".format(launch_max))
 
@@ -2714,12 +3799,21 @@ def ConfigureNodes(nodelist):
         if n._env['bridgeauthority']:
             network._dfltEnv['hasbridgeauth'] = True
 
+@chutney.Util.memoized
 def getTests():
+    """Return a tuple of the names of the chutney tests.
+
+       The tests don't change while chutney is running, so we only list
+       them once per process.
+    """
     chutney_path = get_absolute_chutney_path()
     chutney_tests_path = chutney_path / "scripts" / "chutney_tests"
 
-    return [test.stem for test in chutney_tests_path.glob("*.py")
-            if not test.name.startswith("_")]
+    # scandir() gives us the names without creating a Path for each file
+    with os.scandir(chutney_tests_path) as entries:
+        return tuple(entry.name[:-len(".py")] for entry in entries
+                     if entry.name.endswith(".py") and
+                     not entry.name.startswith("_"))
 
 
 def usage(network):
@@ -2738,7 +3832,7 @@ def exit_on_error(err_msg):
     sys.exit(1)
 
 
-def runConfigFile(verb, data):
+def runConfigFile(verb, data, filename='<config>'):
     _GLOBALS = dict(_BASE_ENVIRON=_BASE_ENVIRON,
                     Node=Node,
                     Require=Require,
@@ -2747,7 +3841,7 @@ def runConfigFile(verb, data):
                     torrc_option_warn_count=0,
                     TORRC_OPTION_WARN_LIMIT=10)
 
-    exec(data, _GLOBALS)
+    exec(compile(data, filename, 'exec'), _GLOBALS)
     network = _GLOBALS['_THE_NETWORK']
 
     # let's check if the verb is a valid test and run it
@@ -2786,7 +3880,7 @@ def main():
 
     args = parseArgs()
     f = open(args['network_cfg'])
-    result = runConfigFile(args['action'], f.read())
+    result = runConfigFile(args['action'], f.read(), args['network_cfg'])
     if result is False:
         return -1
     return 0